@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+import expedido_n_chegou as robo
+
+try:
+    # Opcional: gera os 'pedidos' no formato .xls verdadeiro (BIFF), como vêm do sistema.
+    import xlwt
+except ImportError:
+    xlwt = None
+
+try:
+    # Opcional: mede o pico de memória do processo (RSS) em cada passo, além do tracemalloc.
+    import psutil
+except ImportError:
+    psutil = None
+
+import xlsxwriter
+
+# --- BENCHMARK DO ROBÔ "EXPEDIDO MAS NÃO CHEGOU" COM DADOS SINTÉTICOS ---
+# Gera exportações de 'pedidos' (.xls) e 'gb' (.xlsx) com as colunas nas posições reais
+# e mede cada PASSO separadamente, com o Sheets trocado por uma planilha local falsa.
+
+LINHAS_POR_XLS = 65000  # O formato .xls aceita no máximo 65.536 linhas por planilha
+LINHAS_POR_XLSX = 1000000  # O .xlsx aceita no máximo 1.048.576 linhas por planilha
+COLUNAS_NO_GB = 79  # Colunas 0 a 78; a 78 é a sigla regional
+
+SIGLAS = list(robo.mapa_estados.keys())
+BASES = [f'BASE {i:03d}' for i in range(200)]
+SCS_DESTINO = ['SP BRE', 'RJ - RIO DE JANEIRO', 'MG - BELO HORIZONTE', 'PR - CURITIBA', 'BA - SALVADOR']
+OUTROS_STATUS = ['到件', '派件', '签收', '问题件']
+
+
+# Substitui a aba do gspread: guarda as linhas em memória.
+class PlanilhaFalsa:
+    def __init__(self):
+        self.linhas = []
+
+    def row_values(self, numero_linha):
+        return self.linhas[numero_linha - 1] if len(self.linhas) >= numero_linha else []
+
+    def update(self, celula, linhas, value_input_option=None):
+        self.linhas = list(linhas)
+
+    def append_rows(self, linhas, value_input_option=None):
+        self.linhas.extend(linhas)
+
+
+def gerar_pedido(aleatorio, fracao_hifen):
+    numero = f"JT{aleatorio.randrange(10**12, 10**13)}"
+    if aleatorio.random() < fracao_hifen:
+        numero = f"{numero}-{aleatorio.randint(1, 9)}"
+    return numero
+
+
+# Grava os 'pedidos' em arquivos .xls (ou .xlsx renomeado, sem o xlwt) e devolve as chaves geradas.
+def gerar_pedidos(pasta, linhas, fracao_hifen, aleatorio):
+    chaves = []
+    for parte, inicio in enumerate(range(0, linhas, LINHAS_POR_XLS), start=1):
+        quantidade = min(LINHAS_POR_XLS, linhas - inicio)
+        caminho = os.path.join(pasta, f'pedidos_{parte:03d}.xls')
+        registros = []
+        for _ in range(quantidade):
+            pedido, base = gerar_pedido(aleatorio, fracao_hifen), aleatorio.choice(BASES)
+            registros.append((pedido, aleatorio.choice(SIGLAS), base, aleatorio.choice(SCS_DESTINO)))
+            chaves.append((pedido, base))
+        if xlwt is not None:
+            workbook = xlwt.Workbook()
+            planilha = workbook.add_sheet('Sheet1')
+            for numero_linha, registro in enumerate(registros):
+                for numero_coluna, valor in enumerate(registro):
+                    planilha.write(numero_linha, numero_coluna, valor)
+            workbook.save(caminho)
+        else:
+            # O pandas reconhece o formato pelo conteúdo, então um .xlsx com extensão .xls é lido do mesmo jeito.
+            workbook = xlsxwriter.Workbook(caminho, {'constant_memory': True})
+            planilha = workbook.add_worksheet('Sheet1')
+            for numero_linha, registro in enumerate(registros):
+                planilha.write_row(numero_linha, 0, registro)
+            workbook.close()
+    return chaves
+
+
+# Grava o 'gb' em arquivos .xlsx de 79 colunas; parte das linhas reaproveita chaves dos 'pedidos'.
+def gerar_gb(pasta, linhas, chaves_pedidos, fracao_status, fracao_cruzamento, aleatorio):
+    for parte, inicio in enumerate(range(0, linhas, LINHAS_POR_XLSX), start=1):
+        quantidade = min(LINHAS_POR_XLSX, linhas - inicio)
+        workbook = xlsxwriter.Workbook(os.path.join(pasta, f'gb_{parte:03d}.xlsx'), {'constant_memory': True})
+        planilha = workbook.add_worksheet('Sheet1')
+        linha = [''] * COLUNAS_NO_GB
+        for numero_linha in range(quantidade):
+            if chaves_pedidos and aleatorio.random() < fracao_cruzamento:
+                pedido, base = aleatorio.choice(chaves_pedidos)
+            else:
+                pedido, base = gerar_pedido(aleatorio, 0), aleatorio.choice(BASES)
+            linha[0] = pedido
+            linha[1] = robo.status_alvo if aleatorio.random() < fracao_status else aleatorio.choice(OUTROS_STATUS)
+            linha[4] = base
+            linha[78] = aleatorio.choice(SIGLAS)
+            planilha.write_row(numero_linha, 0, linha)
+        workbook.close()
+
+
+# Acompanha o pico de RSS do processo e dos seus filhos (processos de leitura e escrita) numa thread
+# enquanto um passo roda (precisa do psutil).
+class MedidorDeMemoria:
+    def __init__(self, intervalo=0.01):
+        self.intervalo = intervalo
+        self.pico = 0
+        self._parar = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if psutil is not None:
+            processo = psutil.Process()
+            self.pico = processo.memory_info().rss
+
+            def amostrar():
+                while not self._parar.wait(self.intervalo):
+                    rss = processo.memory_info().rss
+                    for filho in processo.children(recursive=True):
+                        try:
+                            rss += filho.memory_info().rss
+                        except psutil.Error:
+                            pass  # Filho que terminou entre a listagem e a leitura
+                    self.pico = max(self.pico, rss)
+
+            self._thread = threading.Thread(target=amostrar, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def carregar_e_limpar_pedidos():
+    df_pedidos, arquivos_pedidos = robo.carregar_planilhas_da_pasta(robo.pasta_pedidos, 'xls', leitor=robo.ler_pedidos)
+    return robo.limpar_pedidos(df_pedidos), arquivos_pedidos
+
+
+def cpu_dos_filhos():
+    # Inclui os processos de leitura e escrita do robô depois que o pool deles é encerrado (ao fim de cada passo).
+    tempos = os.times()
+    return tempos.children_user + tempos.children_system
+
+def medir(resultados, nome_passo, funcao, *args):
+    tracemalloc.start()
+    inicio_cpu, inicio_cpu_filhos, inicio = time.process_time(), cpu_dos_filhos(), time.perf_counter()
+    with MedidorDeMemoria() as medidor:
+        retorno = funcao(*args)
+    duracao, duracao_cpu = time.perf_counter() - inicio, time.process_time() - inicio_cpu
+    duracao_cpu_filhos = cpu_dos_filhos() - inicio_cpu_filhos
+    _, pico_python = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    resultados[nome_passo] = {
+        'segundos': round(duracao, 3),
+        'segundos_cpu': round(duracao_cpu, 3),
+        'segundos_cpu_filhos': round(duracao_cpu_filhos, 3),
+        'pico_python_mb': round(pico_python / 2**20, 1),
+        'pico_rss_mb': round(medidor.pico / 2**20, 1) if psutil is not None else None,
+    }
+    return retorno
+
+
+def executar_benchmark(pasta_base, linhas, args):
+    aleatorio = random.Random(args.semente)
+    # Todos os parâmetros da geração entram no nome da pasta: mudar qualquer um gera dados novos.
+    pasta_dados = os.path.join(
+        pasta_base,
+        f'dados_{linhas}_semente{args.semente}_status{args.fracao_status}_hifen{args.fracao_hifen}_cruzamento{args.fracao_cruzamento}'
+    )
+    pasta_pedidos, pasta_gb = os.path.join(pasta_dados, 'pedidos'), os.path.join(pasta_dados, 'gb')
+    if not os.path.isdir(pasta_dados):
+        print(f"\n--- Gerando {linhas} linhas de 'pedidos' e de 'gb' em {pasta_dados} ---")
+        os.makedirs(pasta_pedidos)
+        os.makedirs(pasta_gb)
+        chaves = gerar_pedidos(pasta_pedidos, linhas, args.fracao_hifen, aleatorio)
+        gerar_gb(pasta_gb, linhas, chaves, args.fracao_status, args.fracao_cruzamento, aleatorio)
+
+    # O passo 7 move os arquivos de entrada, então o robô trabalha sobre uma cópia.
+    pasta_execucao = os.path.join(pasta_base, f'execucao_{linhas}')
+    shutil.rmtree(pasta_execucao, ignore_errors=True)
+    shutil.copytree(pasta_dados, os.path.join(pasta_execucao, 'entrada'))
+    robo.pasta_pedidos = os.path.join(pasta_execucao, 'entrada', 'pedidos')
+    robo.pasta_gb = os.path.join(pasta_execucao, 'entrada', 'gb')
+    robo.pasta_resultado = os.path.join(pasta_execucao, 'resultado')
+    robo.pasta_lixeira = os.path.join(pasta_execucao, 'lixeira')
+    robo.pasta_cache = os.path.join(pasta_base, 'cache') if args.com_cache else ''
+
+    print(f"\n--- Medindo os passos com {linhas} linhas ---")
+    resultados = {}
+    df_pedidos, arquivos_pedidos = medir(resultados, 'PASSO 1', carregar_e_limpar_pedidos)
+    df_gb, arquivos_gb = medir(resultados, 'PASSO 2', robo.carregar_planilhas_da_pasta, robo.pasta_gb, 'xlsx', robo.ler_gb_filtrado)
+    df_resultado = medir(resultados, 'PASSO 3', robo.cruzar_dados, df_pedidos, df_gb)
+    if df_resultado is None or df_resultado.empty:
+        print("AVISO: O cruzamento não trouxe resultados; os passos 4 a 6 foram pulados.")
+    else:
+        horario_execucao = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        df_para_sheets, df_consolidado, df_divididos = medir(
+            resultados, 'PASSO 4', robo.preparar_relatorios, df_resultado, 'Benchmark', 'T1', horario_execucao
+        )
+        medir(resultados, 'PASSO 5', robo.salvar_resultados_locais, df_divididos, df_consolidado)
+        caminho_checkpoint = os.path.join(pasta_execucao, 'checkpoint_sheets.json')
+        medir(resultados, 'PASSO 6', robo.enviar_para_sheets, df_para_sheets, PlanilhaFalsa(), caminho_checkpoint)
+    medir(resultados, 'PASSO 7', robo.arquivar_arquivos_processados, arquivos_pedidos, arquivos_gb)
+    resultados['linhas_cruzadas'] = 0 if df_resultado is None else len(df_resultado)
+    if not args.manter_arquivos:
+        shutil.rmtree(pasta_execucao, ignore_errors=True)
+    return resultados
+
+
+def imprimir_tabela(todos_resultados):
+    print("\n--- RESULTADOS ---")
+    print(f"{'linhas':>10} {'passo':>8} {'seg':>9} {'seg cpu':>9} {'cpu filhos':>11} {'pico py MB':>11} {'pico RSS MB':>12}")
+    for linhas, resultados in todos_resultados.items():
+        for passo, medida in resultados.items():
+            if not isinstance(medida, dict):
+                continue
+            rss = '-' if medida['pico_rss_mb'] is None else f"{medida['pico_rss_mb']:.1f}"
+            print(
+                f"{linhas:>10} {passo:>8} {medida['segundos']:>9.3f} {medida['segundos_cpu']:>9.3f} "
+                f"{medida['segundos_cpu_filhos']:>11.3f} {medida['pico_python_mb']:>11.1f} {rss:>12}"
+            )
+
+
+def ler_argumentos():
+    parser = argparse.ArgumentParser(description="Benchmark do robô 'expedido mas não chegou' com dados sintéticos.")
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=[10000, 100000], help="Linhas de 'pedidos' e de 'gb' (ex.: 10000 1000000 5000000).")
+    parser.add_argument('--fracao-status', type=float, default=0.3, help="Parcela das linhas do 'gb' com o status '中心发件'.")
+    parser.add_argument('--fracao-hifen', type=float, default=0.05, help="Parcela dos pedidos com '-' (descartados na limpeza).")
+    parser.add_argument('--fracao-cruzamento', type=float, default=0.5, help="Parcela das linhas do 'gb' que repetem uma chave dos 'pedidos'.")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--pasta', help="Onde guardar os dados gerados (reaproveitados entre execuções). Padrão: pasta temporária.")
+    parser.add_argument('--com-cache', action='store_true', help="Liga o cache de planilhas do robô.")
+    parser.add_argument('--manter-arquivos', action='store_true', help="Não apaga os resultados e a lixeira de cada execução.")
+    parser.add_argument('--saida', help="Grava os resultados em JSON neste arquivo.")
+    return parser.parse_args()
+
+
+def main():
+    args = ler_argumentos()
+    pasta_base = args.pasta or os.path.join(tempfile.gettempdir(), 'benchmark_expedido')
+    os.makedirs(pasta_base, exist_ok=True)
+    if psutil is None:
+        print("AVISO: psutil não instalado; o pico de RSS não será medido (apenas o tracemalloc).")
+    todos_resultados = {linhas: executar_benchmark(pasta_base, linhas, args) for linhas in args.tamanhos}
+    imprimir_tabela(todos_resultados)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version, 'pandas': pd.__version__, 'resultados': todos_resultados}, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados gravados em: {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
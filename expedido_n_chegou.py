@@ -3,11 +3,46 @@ import os
 import glob
 import math
 from datetime import datetime
-import gspread
-from google.oauth2.service_account import Credentials
-import numpy as np
 import shutil
-import questionary 
+import hashlib
+import gzip
+import sqlite3
+import json
+import time
+import random
+import argparse
+import threading
+import tempfile
+import sys
+import functools
+import traceback
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    # Opcional: com o xlsxwriter os arquivos .xlsx são gravados em modo streaming (memória constante).
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+try:
+    # Pico de memória do processo (Linux/macOS). No Windows usa-se o psutil, se instalado.
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    # Opcional: com o watchdog o modo daemon é avisado pelo sistema (inotify) em vez de varrer as pastas.
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
 
 # --- DICIONÁRIO DE TRADUÇÃO DE ESTADOS (PARA O MAPA NO LOOKER) ---
 mapa_estados = {
@@ -21,178 +56,1075 @@ mapa_estados = {
 }
 
 
-# --- COLETA DE INFORMAÇÕES DO USUÁRIO (COM MENU INTERATIVO) ---
-print("--- Por favor, selecione as informações do registro ---")
-
-registrante = questionary.text(
-    "Qual o seu nome?",
-    validate=lambda text: True if len(text) > 0 else "O nome é obrigatório. Por favor, tente novamente."
-).ask().title()
-
-turno = questionary.select(
-    "Qual o seu turno?",
-    choices=[
-        "T1",
-        "T2",
-        "T3"
-    ]
-).ask()
-
-print(f"\nObrigado, {registrante}! Iniciando a automação para o turno {turno}...\n")
-
-
 # --- 1. CONFIGURAÇÃO DAS PASTAS E PARÂMETROS ---
-print("--- INICIANDO ROBÔ DE CRUZAMENTO DE DADOS (VERSÃO FINAL) ---")
-
 pasta_pedidos = r''
 pasta_gb = r''
 pasta_resultado = r''
 pasta_lixeira = r''
+pasta_cache = r''  # Cache das planilhas já lidas (parquet). Vazio = sem cache.
+ignorar_arquivos_repetidos = True  # Pula cópias idênticas na mesma leva e execuções cujas entradas já foram cruzadas juntas antes
 
 # CONFIGURAÇÃO DO GOOGLE SHEETS
 NOME_DA_PLANILHA_SHEETS = "J&T EXPRESS - EXPEDIDO MAS NÃO CHEGOU"
 NOME_DA_ABA_SHEETS = "Consolidado"
 ARQUIVO_DE_CREDENCIAL = 'credentials.json'
+ARQUIVO_CHECKPOINT_SHEETS = 'envio_sheets_pendente.json'  # Envio interrompido é retomado na próxima execução
+linhas_por_lote_sheets = 500
+tentativas_por_lote_sheets = 6
+espera_inicial_sheets_segundos = 2
+
+# ÍNDICE LOCAL DOS PEDIDOS JÁ ENVIADOS (EVITA DUPLICADOS NO SHEETS)
+ARQUIVO_INDICE_EXPORTADOS = 'pedidos_exportados.db'
 
 status_alvo = '中心发件'
 linhas_por_arquivo = 500
+formato_saida = 'xlsx'  # 'xlsx', 'csv' ou 'parquet' para os arquivos locais
+processos_de_leitura = None  # None = um processo por núcleo da máquina
+processos_de_escrita = None
+memoria_maxima_mb = None  # Com um valor, a leitura e o cruzamento são feitos em partições no disco dentro desse orçamento
+fator_memoria_por_byte_em_disco = 10  # Quanto uma planilha ocupa em memória por byte do arquivo (estimativa)
+pasta_trabalho = r''  # Onde ficam as partições temporárias. Vazio = pasta temporária do sistema.
+intervalo_daemon_segundos = 15  # Modo daemon: espera sem mudanças antes de considerar os arquivos completos
+
+# --- REGRAS DE CRUZAMENTO ---
+# Cada regra: status procurado no 'gb', colunas de junção (pedido e base, nessa ordem) em cada planilha,
+# codificação dos arquivos divididos e aba do Sheets. Todas são avaliadas sobre uma única leitura do 'gb'.
+# Uma lista em JSON com o mesmo formato pode ser passada em --regras.
+REGRA_PADRAO = 'expedido_nao_chegou'
+REGRAS_DE_CRUZAMENTO = [
+    {
+        'nome': REGRA_PADRAO,
+        'status': status_alvo,
+        'colunas_pedidos': [0, 2],
+        'colunas_gb': [0, 4],
+        'tipo_de_bipagem': 'Encomenda expedido mas não chegou (有发未到件)',
+        'primeiro_nivel': 'N00',
+        'segundo_nivel': 'N29',
+        'causa': 'Sem recebimento no SC',
+        'aba_sheets': NOME_DA_ABA_SHEETS,
+    },
+]
+CAMPOS_DA_REGRA = ['nome', 'status', 'colunas_pedidos', 'colunas_gb', 'tipo_de_bipagem', 'primeiro_nivel', 'segundo_nivel', 'causa', 'aba_sheets']
+COLUNA_PEDIDO = 0  # Nos 'pedidos': número do pedido, lido sempre porque a limpeza descarta os que têm '-'
+COLUNA_SC_DESTINO = 3  # Nos 'pedidos'
+COLUNA_STATUS_GB = 1
+COLUNA_REGIONAL_GB = 78
+
+def validar_regras(regras):
+    nomes = set()
+    for numero, regra in enumerate(regras, start=1):
+        faltando = [campo for campo in CAMPOS_DA_REGRA if campo not in regra]
+        if faltando:
+            raise ValueError(f"Regra {numero} sem o(s) campo(s): {', '.join(faltando)}.")
+        if len(regra['colunas_pedidos']) != 2 or len(regra['colunas_gb']) != 2:
+            raise ValueError(f"Regra '{regra['nome']}': as colunas de junção devem ser [pedido, base].")
+        if regra['nome'] in nomes:
+            raise ValueError(f"Regra '{regra['nome']}' repetida.")
+        nomes.add(regra['nome'])
+    return regras
+
+def colunas_lidas_dos_pedidos(regras):
+    return sorted({coluna for regra in regras for coluna in regra['colunas_pedidos']} | {COLUNA_PEDIDO, COLUNA_SC_DESTINO})
+
+def colunas_lidas_do_gb(regras):
+    return sorted({coluna for regra in regras for coluna in regra['colunas_gb']} | {COLUNA_STATUS_GB, COLUNA_REGIONAL_GB})
 
 # --- FUNÇÕES AUXILIARES ---
 
-def carregar_planilhas_da_pasta(caminho_pasta, extensao_arquivo):
+def calcular_hash_arquivo(caminho_arquivo, tamanho_bloco=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(caminho_arquivo, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            sha256.update(bloco)
+    return sha256.hexdigest()
+
+hashes_calculados = {}  # Esvaziado no início de cada execução: no modo daemon não cresce sem limite
+
+def hash_do_arquivo(caminho_arquivo):
+    # Evita ler o mesmo arquivo duas vezes na execução (deduplicação e arquivamento usam o mesmo hash).
+    info = os.stat(caminho_arquivo)
+    chave = (os.path.abspath(caminho_arquivo), info.st_size, info.st_mtime_ns)
+    if chave not in hashes_calculados:
+        hashes_calculados[chave] = calcular_hash_arquivo(caminho_arquivo)
+    return hashes_calculados[chave]
+
+def nome_do_leitor(leitor):
+    # Leitores com colunas/status fixados (functools.partial) entram na chave do cache com esses parâmetros.
+    if isinstance(leitor, functools.partial):
+        return f"{leitor.func.__name__}{leitor.args}{sorted(leitor.keywords.items())}"
+    return leitor.__name__
+
+def caminho_no_cache(arquivo, pasta_de_cache, leitor, hash_arquivo=None):
+    # A chave combina caminho, tamanho, data de modificação, conteúdo e leitor: qualquer mudança gera uma nova entrada.
+    info = os.stat(arquivo)
+    hash_arquivo = hash_arquivo or calcular_hash_arquivo(arquivo)
+    chave = f"{os.path.abspath(arquivo)}|{info.st_size}|{info.st_mtime_ns}|{hash_arquivo}|{nome_do_leitor(leitor)}"
+    return os.path.join(pasta_de_cache, hashlib.sha256(chave.encode('utf-8')).hexdigest() + '.parquet')
+
+# Chaves do cruzamento ficam em texto compacto (arrow quando disponível); colunas de poucos valores viram categoria.
+try:
+    import pyarrow  # noqa: F401
+    tipo_texto = pd.StringDtype('pyarrow')
+except ImportError:
+    tipo_texto = pd.StringDtype()
+
+def como_texto(serie):
+    # Números inteiros lidos como float (por causa de células vazias) viram '123', não '123.0'.
+    if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+        serie = serie.astype('Int64')
+    return serie.astype(tipo_texto)
+
+def tipar_colunas(df, colunas_categoria):
+    return pd.DataFrame({
+        coluna: df[coluna].astype('category') if coluna in colunas_categoria else como_texto(df[coluna])
+        for coluna in df.columns
+    })
+
+def tipar_pedidos(df):
+    return tipar_colunas(df, {COLUNA_SC_DESTINO})
+
+def tipar_gb(df):
+    return tipar_colunas(df, {COLUNA_STATUS_GB, COLUNA_REGIONAL_GB})
+
+def concatenar_planilhas(lista_de_dfs):
+    # Categorias diferentes entre arquivos fazem o concat voltar para object; aqui as colunas voltam a ser categoria.
+    df_completo = pd.concat(lista_de_dfs, ignore_index=True)
+    for coluna, tipo in lista_de_dfs[0].dtypes.items():
+        if isinstance(tipo, pd.CategoricalDtype) and not isinstance(df_completo[coluna].dtype, pd.CategoricalDtype):
+            df_completo[coluna] = df_completo[coluna].astype('category')
+    return df_completo
+
+def ler_planilha_completa(arquivo):
+    return pd.read_excel(arquivo, header=None)
+
+def ler_pedidos(arquivo, colunas=None):
+    colunas = colunas or colunas_lidas_dos_pedidos(REGRAS_DE_CRUZAMENTO)
+    return tipar_pedidos(pd.read_excel(arquivo, header=None, usecols=colunas))
+
+def converter_celula(valor):
+    # Mesmas conversões do pd.read_excel: texto vazio vira nulo e número inteiro salvo como float vira int.
+    if valor == '':
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+def ler_gb_filtrado(arquivo, colunas=None, status=None):
+    # Lê a planilha linha a linha e guarda só as colunas usadas das linhas com algum dos status das regras.
+    colunas = colunas or colunas_lidas_do_gb(REGRAS_DE_CRUZAMENTO)
+    status = set(status or [regra['status'] for regra in REGRAS_DE_CRUZAMENTO])
+    from openpyxl import load_workbook
+    ultima_coluna = max(colunas) + 1
+    coluna_status = colunas.index(COLUNA_STATUS_GB)
+    linhas_filtradas = []
+    workbook = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        for linha in workbook.worksheets[0].iter_rows(max_col=ultima_coluna, values_only=True):
+            linha = linha + (None,) * (ultima_coluna - len(linha))
+            valores = [converter_celula(linha[coluna]) for coluna in colunas]
+            if valores[coluna_status] in status:
+                linhas_filtradas.append(valores)
+    finally:
+        workbook.close()
+    return tipar_gb(pd.DataFrame(linhas_filtradas, columns=colunas))
+
+def leitor_de_pedidos(regras):
+    # Parâmetros explícitos: os processos de leitura não enxergam regras carregadas em tempo de execução.
+    return functools.partial(ler_pedidos, colunas=colunas_lidas_dos_pedidos(regras))
+
+def leitor_do_gb(regras):
+    return functools.partial(ler_gb_filtrado, colunas=colunas_lidas_do_gb(regras), status=sorted({regra['status'] for regra in regras}))
+
+def ler_planilha_com_cache(arquivo, pasta_de_cache, leitor=ler_planilha_completa, hash_arquivo=None):
+    # Além do DataFrame, devolve as medidas da leitura deste arquivo para o relatório da execução.
+    pico_reiniciado = reiniciar_pico_de_memoria()
+    inicio, inicio_cpu = time.perf_counter(), time.process_time()
+    medida = {'arquivo': os.path.basename(arquivo), 'bytes': os.path.getsize(arquivo), 'do_cache': False}
+    caminho_cache = caminho_no_cache(arquivo, pasta_de_cache, leitor, hash_arquivo) if pasta_de_cache else None
+    if caminho_cache and os.path.exists(caminho_cache):
+        df = pd.read_parquet(caminho_cache)
+        df.columns = [int(coluna) for coluna in df.columns]
+        medida['do_cache'] = True
+        return df, finalizar_medida_arquivo(medida, df, inicio, inicio_cpu, pico_reiniciado)
+    df = leitor(arquivo)
+    if caminho_cache:
+        try:
+            os.makedirs(pasta_de_cache, exist_ok=True)
+            df_cache = df.copy()
+            df_cache.columns = [str(coluna) for coluna in df_cache.columns]
+            caminho_temporario = caminho_cache + '.tmp'
+            df_cache.to_parquet(caminho_temporario, index=False)
+            os.replace(caminho_temporario, caminho_cache)
+        except Exception as e:
+            print(f"  -> AVISO: Não foi possível gravar '{os.path.basename(arquivo)}' no cache: {e}")
+    return df, finalizar_medida_arquivo(medida, df, inicio, inicio_cpu, pico_reiniciado)
+
+def finalizar_medida_arquivo(medida, df, inicio, inicio_cpu, pico_reiniciado):
+    # Medido no processo que leu o arquivo (em geral um processo de leitura, reaproveitado entre arquivos).
+    medida.update({
+        'linhas': len(df),
+        'segundos': round(time.perf_counter() - inicio, 3),
+        'segundos_cpu': round(time.process_time() - inicio_cpu, 3),
+        'pico_rss_mb': memoria_do_processo_mb('VmHWM') if pico_reiniciado else pico_de_memoria_mb(),
+    })
+    if not pico_reiniciado:
+        medida['pico_rss_desde_o_inicio_do_processo'] = True
+    return medida
+
+def listar_arquivos_da_pasta(caminho_pasta, extensao_arquivo):
     padrao_busca = os.path.join(caminho_pasta, f'*.{extensao_arquivo}')
     lista_arquivos = glob.glob(padrao_busca)
     if not lista_arquivos:
         print(f"AVISO: Nenhum arquivo '.{extensao_arquivo}' encontrado na pasta: {caminho_pasta}")
+    return lista_arquivos
+
+def descartar_arquivos_repetidos(arquivos, medidas_arquivos=None):
+    # Só cópias dentro da mesma leva: um arquivo igual a outro de execução anterior ainda é lido, porque o outro
+    # lado do cruzamento pode ser novo. Pedidos já enviados em execuções anteriores são barrados pelo índice.
+    arquivos_novos, hashes_vistos = [], set()
+    for arquivo in arquivos:
+        hash_arquivo = hash_do_arquivo(arquivo)
+        if hash_arquivo in hashes_vistos:
+            print(f"  -> Ignorando '{os.path.basename(arquivo)}': conteúdo idêntico a outro arquivo desta leva.")
+            if medidas_arquivos is not None:
+                medidas_arquivos.append({'arquivo': os.path.basename(arquivo), 'repetido': True, 'linhas': 0, 'segundos_cpu': 0})
+            continue
+        hashes_vistos.add(hash_arquivo)
+        arquivos_novos.append(arquivo)
+    return arquivos_novos
+
+def iterar_planilhas(lista_arquivos, leitor=ler_planilha_completa, arquivos_por_vez=None, medidas_arquivos=None):
+    # Entrega um DataFrame por arquivo, na ordem da lista. Com arquivos_por_vez, só esse número de planilhas fica em memória.
+    arquivos_para_ler = [arquivo for arquivo in lista_arquivos if not os.path.basename(arquivo).startswith('~$')]
+    if ignorar_arquivos_repetidos:
+        arquivos_para_ler = descartar_arquivos_repetidos(arquivos_para_ler, medidas_arquivos)
+    arquivos_por_vez = arquivos_por_vez or max(len(arquivos_para_ler), 1)
+    processos = min(arquivos_por_vez, processos_de_leitura or os.cpu_count() or 1)
+    executor = ProcessPoolExecutor(max_workers=processos) if len(arquivos_para_ler) > 1 else None
+    mapear = executor.map if executor else map
+    lidos_do_cache = 0
+    try:
+        for inicio in range(0, len(arquivos_para_ler), arquivos_por_vez):
+            lote = arquivos_para_ler[inicio:inicio + arquivos_por_vez]
+            for arquivo in lote:
+                print(f"  -> Lendo arquivo: {os.path.basename(arquivo)}")
+            hashes = [hash_do_arquivo(arquivo) if ignorar_arquivos_repetidos else None for arquivo in lote]
+            for df_temp, medida in mapear(ler_planilha_com_cache, lote, [pasta_cache] * len(lote), [leitor] * len(lote), hashes):
+                lidos_do_cache += medida['do_cache']
+                if medidas_arquivos is not None:
+                    medidas_arquivos.append(medida)
+                yield df_temp
+    finally:
+        if executor:
+            executor.shutdown()
+    if lidos_do_cache:
+        print(f"  -> {lidos_do_cache} de {len(arquivos_para_ler)} arquivo(s) carregado(s) do cache.")
+
+def carregar_planilhas_da_pasta(caminho_pasta, extensao_arquivo, leitor=ler_planilha_completa, medidas_arquivos=None):
+    lista_arquivos = listar_arquivos_da_pasta(caminho_pasta, extensao_arquivo)
+    if not lista_arquivos:
         return pd.DataFrame(), []
-    lista_de_dfs = []
-    for arquivo in lista_arquivos:
-        if os.path.basename(arquivo).startswith('~$'): continue
-        print(f"  -> Lendo arquivo: {os.path.basename(arquivo)}")
-        df_temp = pd.read_excel(arquivo, header=None)
-        lista_de_dfs.append(df_temp)
-    df_completo = pd.concat(lista_de_dfs, ignore_index=True) if lista_de_dfs else pd.DataFrame()
+    lista_de_dfs = list(iterar_planilhas(lista_arquivos, leitor, medidas_arquivos=medidas_arquivos))
+    df_completo = concatenar_planilhas(lista_de_dfs) if lista_de_dfs else pd.DataFrame()
     return df_completo, lista_arquivos
 
-def enviar_para_sheets(dataframe_para_enviar):
+# --- RELATÓRIO DA EXECUÇÃO (TEMPO, CPU, MEMÓRIA E LINHAS DE CADA PASSO) ---
+
+# No Linux o pico de memória (VmHWM) pode ser zerado, o que permite medir o pico de cada arquivo e de cada passo.
+# Antes de zerá-lo, o pico atual é guardado em pico_acumulado_mb para não perder o pico do passo em andamento.
+pico_acumulado_mb = 0.0
+
+def memoria_do_processo_mb(campo):
+    # 'VmHWM' = pico desde o último reinício, 'VmRSS' = memória atual.
     try:
-        print("\n[PASSO 6 de 7] Conectando ao Sheets...")
-        scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        creds = Credentials.from_service_account_file(ARQUIVO_DE_CREDENCIAL, scopes=scopes)
-        client = gspread.authorize(creds)
-        spreadsheet = client.open(NOME_DA_PLANILHA_SHEETS)
-        worksheet = spreadsheet.worksheet(NOME_DA_ABA_SHEETS)
-        print(f"  -> Conectado à planilha '{NOME_DA_PLANILHA_SHEETS}' e à aba '{NOME_DA_ABA_SHEETS}' com sucesso.")
-        dataframe_para_enviar = dataframe_para_enviar.replace({np.nan: None})
-        dados_para_adicionar = dataframe_para_enviar.values.tolist()
-        primeira_linha = worksheet.row_values(1)
-        if not primeira_linha:
-            print("  -> Planilha vazia. Adicionando cabeçalho e dados...")
-            cabecalho = [dataframe_para_enviar.columns.tolist()]
-            dados_para_adicionar = cabecalho + dados_para_adicionar
-            worksheet.update('A1', dados_para_adicionar, value_input_option='USER_ENTERED')
+        with open('/proc/self/status') as f:
+            for linha in f:
+                if linha.startswith(campo + ':'):
+                    return round(int(linha.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if psutil is not None and campo == 'VmRSS':
+        return round(psutil.Process().memory_info().rss / 2**20, 1)
+    return None
+
+def reiniciar_pico_de_memoria():
+    global pico_acumulado_mb
+    pico_atual = memoria_do_processo_mb('VmHWM')
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    pico_acumulado_mb = max(pico_acumulado_mb, pico_atual or 0)
+    return True
+
+def pico_de_memoria_mb():
+    # Pico desde o início do processo (quando o pico não pode ser zerado).
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(pico / 2**20 if sys.platform == 'darwin' else pico / 1024, 1)  # macOS em bytes, Linux em KB
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 2**20, 1)
+    return None
+
+def novo_relatorio_execucao(registrante, turno):
+    return {
+        'inicio': datetime.now().isoformat(timespec='seconds'), 'registrante': registrante, 'turno': turno,
+        'modo': 'fora_da_memoria' if memoria_maxima_mb else 'em_memoria', 'passos': [], 'arquivos': {'pedidos': [], 'gb': []}
+    }
+
+@contextmanager
+def medir_passo(relatorio, nome_passo, regra=None):
+    # Quem chama preenche linhas_entrada/linhas_saida no dicionário devolvido.
+    # pico_rss_mb é o pico do processo principal durante o passo; o dos processos de leitura fica em pico_rss_leitores_mb.
+    global pico_acumulado_mb
+    medida = {'passo': nome_passo} if regra is None else {'passo': nome_passo, 'regra': regra}
+    pico_reiniciado = reiniciar_pico_de_memoria()
+    pico_acumulado_mb = 0.0
+    medida['rss_inicio_mb'] = memoria_do_processo_mb('VmRSS')
+    inicio, inicio_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield medida
+    finally:
+        medida['segundos'] = round(time.perf_counter() - inicio, 3)
+        medida['segundos_cpu'] = round(time.process_time() - inicio_cpu, 3)
+        medida['rss_fim_mb'] = memoria_do_processo_mb('VmRSS')
+        if pico_reiniciado:
+            medida['pico_rss_mb'] = max(pico_acumulado_mb, memoria_do_processo_mb('VmHWM') or 0)
         else:
-            print("  -> Planilha já contém dados. Adicionando apenas novos pedidos...")
-            worksheet.append_rows(dados_para_adicionar, value_input_option='USER_ENTERED')
-        print(f"SUCESSO: {len(dataframe_para_enviar)} pedidos foram adicionados à planilha.")
+            medida['pico_rss_mb'] = pico_de_memoria_mb()
+            medida['pico_rss_desde_o_inicio_do_processo'] = True
+        if relatorio is not None:
+            relatorio['passos'].append(medida)
+
+def somar_cpu_dos_leitores(medida, medidas_arquivos):
+    # O tempo de CPU e a memória dos processos de leitura não entram nas medidas do processo principal.
+    medida['segundos_cpu_leitores'] = round(sum(m['segundos_cpu'] for m in medidas_arquivos), 3)
+    medida['pico_rss_leitores_mb'] = max((m['pico_rss_mb'] or 0 for m in medidas_arquivos if 'pico_rss_mb' in m), default=None)
+
+def gravar_relatorio_execucao(relatorio, timestamp_execucao):
+    relatorio['fim'] = datetime.now().isoformat(timespec='seconds')
+    if pasta_resultado:
+        os.makedirs(pasta_resultado, exist_ok=True)
+    caminho_relatorio = os.path.join(pasta_resultado, f"{timestamp_execucao}_relatorio_execucao.json")
+    try:
+        with open(caminho_relatorio, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"  -> Relatório da execução salvo em: {caminho_relatorio}")
+    except Exception as e:
+        print(f"\nOcorreu um erro ao salvar o relatório da execução: {e}")
+
+def migrar_indice_para_regras(conexao):
+    # Índices criados antes das regras só tinham o pedido como chave: tudo o que já existe é da regra padrão.
+    colunas = [linha[1] for linha in conexao.execute("PRAGMA table_info(pedidos_exportados)")]
+    if not colunas or 'regra' in colunas:
+        return
+    print("  -> Atualizando o índice de pedidos exportados para guardar a regra de cada pedido...")
+    with conexao:
+        conexao.execute("ALTER TABLE pedidos_exportados RENAME TO pedidos_exportados_antigo")
+        criar_tabela_indice(conexao)
+        conexao.execute(
+            "INSERT INTO pedidos_exportados (pedido, regra, registrante, turno, exportado_em) "
+            "SELECT pedido, ?, registrante, turno, exportado_em FROM pedidos_exportados_antigo", (REGRA_PADRAO,)
+        )
+        conexao.execute("DROP TABLE pedidos_exportados_antigo")
+
+def criar_tabela_indice(conexao):
+    conexao.execute(
+        "CREATE TABLE IF NOT EXISTS pedidos_exportados ("
+        "pedido TEXT, regra TEXT, registrante TEXT, turno TEXT, exportado_em TEXT, PRIMARY KEY (pedido, regra))"
+    )
+
+def abrir_indice_exportados(caminho_indice):
+    conexao = sqlite3.connect(caminho_indice)
+    migrar_indice_para_regras(conexao)
+    criar_tabela_indice(conexao)
+    conexao.commit()
+    # Um conjunto em memória por regra responde "já foi exportado?" em O(1) durante toda a execução.
+    pedidos_exportados = {}
+    for pedido, regra in conexao.execute("SELECT pedido, regra FROM pedidos_exportados"):
+        pedidos_exportados.setdefault(regra, set()).add(pedido)
+    return conexao, pedidos_exportados
+
+def consultar_pedido_exportado(conexao, pedidos_exportados, pedido, regra=REGRA_PADRAO):
+    pedido = str(pedido).strip()
+    if pedido not in pedidos_exportados.get(regra, ()):
+        return None
+    registro = conexao.execute(
+        "SELECT registrante, turno, exportado_em FROM pedidos_exportados WHERE pedido = ? AND regra = ?", (pedido, regra)
+    ).fetchone()
+    return {'registrante': registro[0], 'turno': registro[1], 'exportado_em': registro[2]} if registro else None
+
+def filtrar_pedidos_ja_exportados(df_resultado, pedidos_ja_exportados, coluna_pedido=0):
+    chaves = df_resultado[coluna_pedido].astype(str).str.strip()
+    df_novos = df_resultado[~chaves.isin(pedidos_ja_exportados) & ~chaves.duplicated()]
+    print(f"  -> Índice: {len(df_resultado) - len(df_novos)} pedidos já exportados ou repetidos foram ignorados.")
+    return df_novos
+
+def registrar_pedidos_exportados(conexao, pedidos_exportados, pedidos, registrante, turno, horario_execucao, regra=REGRA_PADRAO):
+    novos = [str(pedido).strip() for pedido in pedidos]
+    conexao.executemany(
+        "INSERT OR IGNORE INTO pedidos_exportados (pedido, regra, registrante, turno, exportado_em) VALUES (?, ?, ?, ?, ?)",
+        [(pedido, regra, registrante, turno, horario_execucao) for pedido in novos]
+    )
+    conexao.commit()
+    pedidos_exportados.setdefault(regra, set()).update(novos)
+
+def sem_nulos(df):
+    # NaN/NA de qualquer tipo de coluna viram None (célula vazia no Sheets, no Excel e no JSON).
+    return df.astype(object).where(df.notna(), None)
+
+def conectar_aba_sheets(aba=NOME_DA_ABA_SHEETS):
+    # Importados só aqui: execuções que não chegam ao envio não pagam o carregamento do gspread e do google-auth.
+    import gspread
+    from google.oauth2.service_account import Credentials
+    scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+    creds = Credentials.from_service_account_file(ARQUIVO_DE_CREDENCIAL, scopes=scopes)
+    client = gspread.authorize(creds)
+    spreadsheet = client.open(NOME_DA_PLANILHA_SHEETS)
+    worksheet = spreadsheet.worksheet(aba)
+    print(f"  -> Conectado à planilha '{NOME_DA_PLANILHA_SHEETS}' e à aba '{aba}' com sucesso.")
+    return worksheet
+
+def caminho_checkpoint_da_regra(nome_regra):
+    # Um checkpoint por regra, mesmo quando duas regras enviam para a mesma aba: os pedidos de um envio
+    # retomado são registrados no índice com a regra dele. A regra padrão mantém o nome de sempre.
+    if nome_regra == REGRA_PADRAO:
+        return ARQUIVO_CHECKPOINT_SHEETS
+    raiz, extensao = os.path.splitext(ARQUIVO_CHECKPOINT_SHEETS)
+    return f"{raiz}_{nome_regra}{extensao}"
+
+def gravar_json(caminho, conteudo):
+    caminho_temporario = caminho + '.tmp'
+    with open(caminho_temporario, 'w', encoding='utf-8') as f:
+        json.dump(conteudo, f, ensure_ascii=False)
+    os.replace(caminho_temporario, caminho)
+
+def ler_json(caminho):
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+def erro_de_limite_da_api(erro):
+    # gspread.exceptions.APIError traz a resposta HTTP; 429 é cota estourada, 500/503 são instabilidades do Google.
+    codigo = getattr(getattr(erro, 'response', None), 'status_code', None)
+    return codigo in (429, 500, 502, 503)
+
+def enviar_lote_com_retentativa(worksheet, linhas, com_cabecalho):
+    for tentativa in range(tentativas_por_lote_sheets):
+        try:
+            if com_cabecalho:
+                worksheet.update('A1', linhas, value_input_option='USER_ENTERED')
+            else:
+                worksheet.append_rows(linhas, value_input_option='USER_ENTERED')
+            return
+        except Exception as e:
+            if not erro_de_limite_da_api(e) or tentativa == tentativas_por_lote_sheets - 1:
+                raise
+            espera = espera_inicial_sheets_segundos * (2 ** tentativa) + random.uniform(0, 1)
+            print(f"  -> Limite da API atingido. Nova tentativa em {espera:.1f}s...")
+            time.sleep(espera)
+
+def enviar_checkpoint(worksheet, caminho_checkpoint):
+    # O arquivo de checkpoint guarda os dados uma única vez; o progresso fica num arquivo pequeno ao lado.
+    checkpoint = ler_json(caminho_checkpoint)
+    caminho_progresso = caminho_checkpoint + '.progresso'
+    proxima_linha = (ler_json(caminho_progresso) or {}).get('proxima_linha', 0)
+    cabecalho, linhas = checkpoint['cabecalho'], checkpoint['linhas']
+    if proxima_linha > 0:
+        print(f"  -> Retomando envio a partir da linha {proxima_linha + 1} de {len(linhas)}...")
+    elif not worksheet.row_values(1):
+        print("  -> Planilha vazia. Adicionando cabeçalho e dados...")
+    else:
+        print("  -> Planilha já contém dados. Adicionando apenas novos pedidos...")
+    while proxima_linha < len(linhas):
+        lote = linhas[proxima_linha:proxima_linha + linhas_por_lote_sheets]
+        com_cabecalho = proxima_linha == 0 and not worksheet.row_values(1)
+        enviar_lote_com_retentativa(worksheet, [cabecalho] + lote if com_cabecalho else lote, com_cabecalho)
+        proxima_linha += len(lote)
+        gravar_json(caminho_progresso, {'proxima_linha': proxima_linha})
+        print(f"    -> {proxima_linha} de {len(linhas)} linhas enviadas.")
+    os.remove(caminho_checkpoint)
+    os.remove(caminho_progresso)
+    return pd.DataFrame(linhas, columns=cabecalho)
+
+def pedidos_do_checkpoint(caminho_checkpoint):
+    # Pedidos de um envio interrompido: ainda não estão no índice, mas já vão para o Sheets quando ele for retomado.
+    checkpoint = ler_json(caminho_checkpoint)
+    if not checkpoint:
+        return set()
+    coluna = checkpoint['cabecalho'].index('PEDIDOS')
+    return {str(linha[coluna]).strip() for linha in checkpoint['linhas']}
+
+def gravar_checkpoint(caminho_checkpoint, dataframe_para_enviar):
+    # As linhas novas entram no fim de um envio pendente: o progresso já gravado continua valendo.
+    checkpoint = ler_json(caminho_checkpoint)
+    linhas = dataframe_para_enviar.values.tolist()
+    if checkpoint:
+        print(f"  -> Existe um envio interrompido em execução anterior ({len(checkpoint['linhas'])} linhas). As novas linhas vão depois dele.")
+        checkpoint['linhas'].extend(linhas)
+    else:
+        checkpoint = {'cabecalho': dataframe_para_enviar.columns.tolist(), 'linhas': linhas}
+    gravar_json(caminho_checkpoint, checkpoint)
+
+def enviar_para_sheets(dataframe_para_enviar, worksheet=None, caminho_checkpoint=None, aba=NOME_DA_ABA_SHEETS, regra=REGRA_PADRAO):
+    # Devolve os DataFrames cujo envio terminou nesta chamada (inclusive as linhas de um envio pendente de execução anterior).
+    envios_concluidos = []
+    caminho_checkpoint = caminho_checkpoint or caminho_checkpoint_da_regra(regra)
+    # O checkpoint é gravado antes de conectar: se a conexão falhar, as linhas não se perdem com o arquivamento do PASSO 7.
+    dataframe_para_enviar = sem_nulos(dataframe_para_enviar)
+    if len(dataframe_para_enviar):
+        gravar_checkpoint(caminho_checkpoint, dataframe_para_enviar)
+    if not os.path.exists(caminho_checkpoint):
+        return envios_concluidos
+    try:
+        print(f"\n[PASSO 6 de 7] Conectando ao Sheets (aba '{aba}')...")
+        if worksheet is None:
+            worksheet = conectar_aba_sheets(aba)
+        envios_concluidos.append(enviar_checkpoint(worksheet, caminho_checkpoint))
+        print(f"SUCESSO: {len(envios_concluidos[0])} pedidos foram adicionados à planilha.")
     except Exception as e:
-        print(f"\nOcorreu um erro inesperado ao conectar com o Sheets: {e}")
+        print(f"\nOcorreu um erro inesperado ao enviar para o Sheets: {e}")
+        print(f"  -> O envio será retomado de onde parou na próxima execução ('{caminho_checkpoint}').")
+    return envios_concluidos
+
+def caminho_manifesto_lixeira():
+    return os.path.join(pasta_lixeira, 'manifesto.json')
+
+def ler_manifesto_lixeira():
+    # {hash: {'tipo', 'bytes', 'nomes': [...], 'execucoes': [...]}} de cada arquivo único já arquivado.
+    return ler_json(caminho_manifesto_lixeira()) or {}
+
+def entradas_ja_processadas(arquivos_pedidos, arquivos_gb):
+    # Execução repetida: todas as exportações das duas pastas foram cruzadas juntas numa mesma execução anterior.
+    # Basta estarem contidas nela: o cruzamento de parte dos arquivos não gera pedido que aquela não gerou.
+    # Arquivos já vistos em execuções diferentes (pedidos de uma, 'gb' de outra) nunca foram cruzados entre si.
+    arquivos = [arquivo for arquivo in arquivos_pedidos + arquivos_gb if not os.path.basename(arquivo).startswith('~$')]
+    if not arquivos:
+        return False
+    hashes_por_execucao = {}
+    for hash_arquivo, entrada in ler_manifesto_lixeira().items():
+        for execucao in entrada['execucoes']:
+            hashes_por_execucao.setdefault(execucao, set()).add(hash_arquivo)
+    hashes_atuais = {hash_do_arquivo(arquivo) for arquivo in arquivos}
+    return any(hashes_atuais <= hashes for hashes in hashes_por_execucao.values())
 
-def arquivar_arquivos_processados(arquivos_pedidos, arquivos_gb):
+def arquivar_arquivos_processados(arquivos_pedidos, arquivos_gb, timestamp_execucao=None):
+    # Cada conteúdo é guardado uma única vez, compactado, em objetos/<sha256>.gz; o manifesto registra as execuções que o usaram.
     try:
         print("\n[PASSO 7 de 7] Arquivando arquivos processados...")
-        timestamp_lixeira = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        pasta_destino_run = os.path.join(pasta_lixeira, timestamp_lixeira)
-        pasta_destino_pedidos = os.path.join(pasta_destino_run, 'pedidos')
-        pasta_destino_gb = os.path.join(pasta_destino_run, 'gb')
-        os.makedirs(pasta_destino_pedidos)
-        os.makedirs(pasta_destino_gb)
-        print(f"  -> Pasta de arquivamento criada em: {pasta_destino_run}")
-        for arquivo in arquivos_pedidos:
-            shutil.move(arquivo, pasta_destino_pedidos)
-        print(f"  -> {len(arquivos_pedidos)} arquivo(s) da pasta 'pedidos' foram arquivados.")
-        for arquivo in arquivos_gb:
-            shutil.move(arquivo, pasta_destino_gb)
-        print(f"  -> {len(arquivos_gb)} arquivo(s) da pasta 'gb' foram arquivados.")
+        timestamp_execucao = timestamp_execucao or datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        pasta_objetos = os.path.join(pasta_lixeira, 'objetos')
+        os.makedirs(pasta_objetos, exist_ok=True)
+        manifesto = ler_manifesto_lixeira()
+        objetos_novos = 0
+        for tipo, arquivos in (('pedidos', arquivos_pedidos), ('gb', arquivos_gb)):
+            for arquivo in arquivos:
+                hash_arquivo = hash_do_arquivo(arquivo)
+                caminho_objeto = os.path.join(pasta_objetos, f'{hash_arquivo}.gz')
+                if not os.path.exists(caminho_objeto):
+                    with open(arquivo, 'rb') as origem, gzip.open(caminho_objeto + '.tmp', 'wb') as destino:
+                        shutil.copyfileobj(origem, destino)
+                    os.replace(caminho_objeto + '.tmp', caminho_objeto)
+                    objetos_novos += 1
+                entrada = manifesto.setdefault(hash_arquivo, {'tipo': tipo, 'bytes': os.path.getsize(arquivo), 'nomes': [], 'execucoes': []})
+                if os.path.basename(arquivo) not in entrada['nomes']:
+                    entrada['nomes'].append(os.path.basename(arquivo))
+                if timestamp_execucao not in entrada['execucoes']:
+                    entrada['execucoes'].append(timestamp_execucao)
+                gravar_json(caminho_manifesto_lixeira(), manifesto)
+                os.remove(arquivo)
+            print(f"  -> {len(arquivos)} arquivo(s) da pasta '{tipo}' foram arquivados.")
+        print(f"  -> {objetos_novos} conteúdo(s) novo(s) guardado(s) compactado(s) em: {pasta_objetos}")
     except Exception as e:
         print(f"\nOcorreu um erro ao tentar arquivar os arquivos: {e}")
 
 
-# --- FLUXO PRINCIPAL DO SCRIPT ---
+# --- ETAPAS DO CRUZAMENTO ---
+# Podem ser usadas por outros scripts, no mesmo processo, cada uma recebendo e devolvendo DataFrames:
+# carregar_pedidos/carregar_gb -> limpar_pedidos -> cruzar_regras -> preparar_relatorios
+# -> salvar_resultados_locais -> enviar_para_sheets -> arquivar_arquivos_processados.
+# executar_cruzamento encadeia todas; a linha de comando só monta os parâmetros e a chama.
+
+def remover_pedidos_com_hifen(df_pedidos):
+    return df_pedidos[~df_pedidos[COLUNA_PEDIDO].str.contains('-', regex=False, na=False)]
 
-# [PASSO 1 e 2] Carregamento e Limpeza
-print(f"\n[PASSO 1 de 7] Carregando e limpando a base de 'pedidos'...")
-df_pedidos, lista_arquivos_pedidos = carregar_planilhas_da_pasta(pasta_pedidos, 'xls')
-if not df_pedidos.empty:
+def limpar_pedidos(df_pedidos):
+    if df_pedidos.empty:
+        return df_pedidos
     linhas_antes = len(df_pedidos)
-    df_pedidos = df_pedidos[~df_pedidos[0].astype(str).str.contains('-', na=False)]
+    df_pedidos = remover_pedidos_com_hifen(df_pedidos)
     print(f"  -> Limpeza: {linhas_antes - len(df_pedidos)} pedidos com '-' foram desconsiderados.")
+    return df_pedidos
 
-print(f"\n[PASSO 2 de 7] Carregando planilhas da pasta 'gb'...")
-df_gb, lista_arquivos_gb = carregar_planilhas_da_pasta(pasta_gb, 'xlsx')
+def regra_ou_padrao(regra):
+    return regra if regra is not None else REGRAS_DE_CRUZAMENTO[0]
 
-# [PASSO 3] Cruzamento dos dados
-if df_pedidos.empty or df_gb.empty:
-    print("\nERRO: Uma das fontes de dados está vazia ou foi zerada na limpeza.")
-else:
-    print("\n[PASSO 3 de 7] Aplicando a lógica de filtro e cruzamento...")
-    df_gb_filtrado = df_gb[df_gb[1] == status_alvo].copy()
-    if df_gb_filtrado.empty:
+def preparar_gb_para_merge(df_gb, regra=None):
+    regra = regra_ou_padrao(regra)
+    coluna_pedido, coluna_base = regra['colunas_gb']
+    df_gb_para_merge = df_gb[df_gb[COLUNA_STATUS_GB] == regra['status']][[coluna_pedido, coluna_base, COLUNA_REGIONAL_GB]].copy()
+    df_gb_para_merge.columns = ['chave_A_gb', 'chave_E_gb', 'Regional_Sigla']
+    return df_gb_para_merge
+
+def cruzar_dados(df_pedidos, df_gb, regra=None):
+    regra = regra_ou_padrao(regra)
+    print(f"\n[PASSO 3 de 7] Aplicando a lógica de filtro e cruzamento (regra '{regra['nome']}')...")
+    df_gb_para_merge = preparar_gb_para_merge(df_gb, regra)
+    if df_gb_para_merge.empty:
         print("  -> Nenhum pedido corresponde ao critério do status.")
+        return None
+    return pd.merge(df_pedidos, df_gb_para_merge, left_on=regra['colunas_pedidos'], right_on=['chave_A_gb', 'chave_E_gb'], how='inner')
+
+def carregar_pedidos(regras=None, medidas_arquivos=None):
+    return carregar_planilhas_da_pasta(pasta_pedidos, 'xls', leitor_de_pedidos(regras or REGRAS_DE_CRUZAMENTO), medidas_arquivos)
+
+def carregar_gb(regras=None, medidas_arquivos=None):
+    # Uma única leitura do 'gb' serve a todas as regras.
+    return carregar_planilhas_da_pasta(pasta_gb, 'xlsx', leitor_do_gb(regras or REGRAS_DE_CRUZAMENTO), medidas_arquivos)
+
+def cruzar_regras(df_pedidos, df_gb, regras=None, relatorio=None):
+    # Devolve {nome da regra: resultado do cruzamento (ou None se nenhum pedido tem o status da regra)}.
+    resultados = {}
+    for regra in regras or REGRAS_DE_CRUZAMENTO:
+        with medir_passo(relatorio, 'PASSO 3', regra['nome']) as medida:
+            medida['linhas_entrada'] = len(df_pedidos) + len(df_gb)
+            resultados[regra['nome']] = cruzar_dados(df_pedidos, df_gb, regra)
+            medida['linhas_saida'] = 0 if resultados[regra['nome']] is None else len(resultados[regra['nome']])
+    return resultados
+
+def carregar_e_cruzar_em_memoria(relatorio=None, regras=None):
+    arquivos_medidos = relatorio['arquivos'] if relatorio is not None else {'pedidos': [], 'gb': []}
+
+    # [PASSO 1 e 2] Carregamento e Limpeza
+    with medir_passo(relatorio, 'PASSO 1') as medida:
+        print(f"\n[PASSO 1 de 7] Carregando e limpando a base de 'pedidos'...")
+        df_pedidos, lista_arquivos_pedidos = carregar_pedidos(regras, arquivos_medidos['pedidos'])
+        medida['linhas_entrada'] = len(df_pedidos)
+        df_pedidos = limpar_pedidos(df_pedidos)
+        medida['linhas_saida'] = len(df_pedidos)
+        somar_cpu_dos_leitores(medida, arquivos_medidos['pedidos'])
+
+    with medir_passo(relatorio, 'PASSO 2') as medida:
+        print(f"\n[PASSO 2 de 7] Carregando planilhas da pasta 'gb'...")
+        df_gb, lista_arquivos_gb = carregar_gb(regras, arquivos_medidos['gb'])
+        medida['linhas_saida'] = len(df_gb)
+        somar_cpu_dos_leitores(medida, arquivos_medidos['gb'])
+
+    # [PASSO 3] Cruzamento dos dados
+    if df_pedidos.empty or df_gb.empty:
+        print("\nERRO: Uma das fontes de dados está vazia ou foi zerada na limpeza.")
+        return None, lista_arquivos_pedidos, lista_arquivos_gb
+    return cruzar_regras(df_pedidos, df_gb, regras, relatorio), lista_arquivos_pedidos, lista_arquivos_gb
+
+# --- CRUZAMENTO FORA DA MEMÓRIA (PARTIÇÕES EM DISCO) ---
+# Só a leitura e o cruzamento ficam dentro de memoria_maxima_mb. O resultado de cada regra (os pedidos que
+# cruzaram, em geral muito menos linhas que as entradas) é juntado em memória para os passos 4 a 6.
+
+def calcular_num_particoes(lista_arquivos, memoria_maxima):
+    bytes_em_disco = sum(os.path.getsize(arquivo) for arquivo in lista_arquivos)
+    return max(1, math.ceil(bytes_em_disco * fator_memoria_por_byte_em_disco / (memoria_maxima * 1024 * 1024)))
+
+def calcular_arquivos_por_vez(lista_arquivos, memoria_maxima):
+    # Quantas planilhas lidas cabem juntas no orçamento, pela mesma estimativa das partições (pior caso: o maior arquivo).
+    maior_arquivo = max((os.path.getsize(arquivo) for arquivo in lista_arquivos), default=0)
+    cabem = int(memoria_maxima * 1024 * 1024 // max(maior_arquivo * fator_memoria_por_byte_em_disco, 1))
+    return max(1, min(cabem, processos_de_leitura or os.cpu_count() or 1))
+
+def gravar_particoes(df, coluna_chave, pasta_destino, num_particoes, coluna_ordem, primeira_linha, sufixo):
+    # Cada linha vai para a partição do hash do seu pedido; a coluna de ordem guarda a posição original.
+    os.makedirs(pasta_destino, exist_ok=True)
+    df = df.assign(**{coluna_ordem: range(primeira_linha, primeira_linha + len(df))})
+    particoes = pd.util.hash_pandas_object(df[coluna_chave].astype(str), index=False).to_numpy() % num_particoes
+    for particao, df_particao in df.groupby(particoes, sort=False):
+        df_particao.to_pickle(os.path.join(pasta_destino, f'{particao}_{sufixo}.pkl'))
+    return primeira_linha + len(df)
+
+def ler_particao(pasta_origem, particao):
+    arquivos = glob.glob(os.path.join(pasta_origem, f'{particao}_*.pkl'))
+    if not arquivos:
+        return None
+    return pd.concat([pd.read_pickle(arquivo) for arquivo in arquivos], ignore_index=True)
+
+def cruzar_particoes(pasta_pedidos_particionados, pasta_gb_particionado, num_particoes, regra):
+    resultados = []
+    for particao in range(num_particoes):
+        df_pedidos = ler_particao(pasta_pedidos_particionados, particao)
+        df_gb_para_merge = ler_particao(pasta_gb_particionado, particao)
+        if df_pedidos is None or df_gb_para_merge is None:
+            continue
+        for chave_pedidos, chave_gb in zip(regra['colunas_pedidos'], ('chave_A_gb', 'chave_E_gb')):
+            if df_pedidos[chave_pedidos].dtype != df_gb_para_merge[chave_gb].dtype:
+                df_pedidos[chave_pedidos] = df_pedidos[chave_pedidos].astype(object)
+                df_gb_para_merge[chave_gb] = df_gb_para_merge[chave_gb].astype(object)
+        resultados.append(pd.merge(df_pedidos, df_gb_para_merge, left_on=regra['colunas_pedidos'], right_on=['chave_A_gb', 'chave_E_gb'], how='inner'))
+    if not resultados:
+        return pd.DataFrame(columns=regra['colunas_pedidos'][:1] + ['chave_A_gb', 'chave_E_gb', 'Regional_Sigla'])
+    # Reordena como o merge em memória: pela posição no 'pedidos' e, empatando, pela posição no 'gb'.
+    df_resultado = concatenar_planilhas(resultados)
+    df_resultado = df_resultado.sort_values(['_ordem_pedidos', '_ordem_gb'], kind='stable')
+    return df_resultado.drop(columns=['_ordem_pedidos', '_ordem_gb']).reset_index(drop=True)
+
+def carregar_e_cruzar_fora_da_memoria(memoria_maxima, relatorio=None, regras=None):
+    regras = regras or REGRAS_DE_CRUZAMENTO
+    arquivos_medidos = relatorio['arquivos'] if relatorio is not None else {'pedidos': [], 'gb': []}
+    lista_arquivos_pedidos = listar_arquivos_da_pasta(pasta_pedidos, 'xls')
+    lista_arquivos_gb = listar_arquivos_da_pasta(pasta_gb, 'xlsx')
+    num_particoes = calcular_num_particoes(lista_arquivos_pedidos + lista_arquivos_gb, memoria_maxima)
+    # Regras que juntam pelo mesmo número de pedido compartilham as partições do 'pedidos'.
+    colunas_de_pedido = sorted({regra['colunas_pedidos'][0] for regra in regras})
+    with tempfile.TemporaryDirectory(dir=pasta_trabalho or None) as pasta_particoes:
+        pasta_pedidos_particionados = {coluna: os.path.join(pasta_particoes, 'pedidos', str(coluna)) for coluna in colunas_de_pedido}
+        pasta_gb_particionado = {regra['nome']: os.path.join(pasta_particoes, 'gb', regra['nome']) for regra in regras}
+
+        with medir_passo(relatorio, 'PASSO 1') as medida:
+            print(f"\n[PASSO 1 de 7] Carregando, limpando e particionando a base de 'pedidos' ({num_particoes} partições de até {memoria_maxima} MB)...")
+            total_pedidos = 0
+            arquivos_por_vez = calcular_arquivos_por_vez(lista_arquivos_pedidos, memoria_maxima)
+            for i, df in enumerate(iterar_planilhas(lista_arquivos_pedidos, leitor_de_pedidos(regras), arquivos_por_vez, arquivos_medidos['pedidos'])):
+                df = remover_pedidos_com_hifen(df)
+                if df.empty:
+                    continue
+                for coluna in colunas_de_pedido:
+                    gravar_particoes(df, coluna, pasta_pedidos_particionados[coluna], num_particoes, '_ordem_pedidos', total_pedidos, i)
+                total_pedidos += len(df)
+            medida['linhas_entrada'] = sum(m['linhas'] for m in arquivos_medidos['pedidos'])
+            medida['linhas_saida'] = total_pedidos
+            somar_cpu_dos_leitores(medida, arquivos_medidos['pedidos'])
+
+        with medir_passo(relatorio, 'PASSO 2') as medida:
+            print("\n[PASSO 2 de 7] Carregando e particionando as planilhas da pasta 'gb'...")
+            total_gb = {regra['nome']: 0 for regra in regras}
+            arquivos_por_vez = calcular_arquivos_por_vez(lista_arquivos_gb, memoria_maxima)
+            for i, df in enumerate(iterar_planilhas(lista_arquivos_gb, leitor_do_gb(regras), arquivos_por_vez, arquivos_medidos['gb'])):
+                for regra in regras:
+                    df_gb_para_merge = preparar_gb_para_merge(df, regra)
+                    if not df_gb_para_merge.empty:
+                        total_gb[regra['nome']] = gravar_particoes(
+                            df_gb_para_merge, 'chave_A_gb', pasta_gb_particionado[regra['nome']], num_particoes, '_ordem_gb', total_gb[regra['nome']], i
+                        )
+            medida['linhas_saida'] = sum(total_gb.values())
+            somar_cpu_dos_leitores(medida, arquivos_medidos['gb'])
+
+        if not total_pedidos or not any(total_gb.values()):
+            print("\nERRO: Uma das fontes de dados está vazia ou foi zerada na limpeza.")
+            return None, lista_arquivos_pedidos, lista_arquivos_gb
+
+        resultados = {}
+        for regra in regras:
+            with medir_passo(relatorio, 'PASSO 3', regra['nome']) as medida:
+                print(f"\n[PASSO 3 de 7] Cruzando as {num_particoes} partições (regra '{regra['nome']}')...")
+                medida['linhas_entrada'] = total_pedidos + total_gb[regra['nome']]
+                medida['particoes'] = num_particoes
+                if not total_gb[regra['nome']]:
+                    print("  -> Nenhum pedido corresponde ao critério do status.")
+                    resultados[regra['nome']] = None
+                    continue
+                resultados[regra['nome']] = cruzar_particoes(
+                    pasta_pedidos_particionados[regra['colunas_pedidos'][0]], pasta_gb_particionado[regra['nome']], num_particoes, regra
+                )
+                medida['linhas_saida'] = len(resultados[regra['nome']])
+    return resultados, lista_arquivos_pedidos, lista_arquivos_gb
+
+def preparar_relatorios(df_resultado_final, registrante, turno, horario_execucao, regra=None):
+    regra = regra_ou_padrao(regra)
+    print(f"\n[PASSO 4 de 7] Preparando os diferentes formatos de relatório (regra '{regra['nome']}')...")
+    coluna_pedido = regra['colunas_pedidos'][0]
+    df_base = pd.DataFrame({
+        'PEDIDOS': df_resultado_final[coluna_pedido], 'Tipo de bipagem': regra['tipo_de_bipagem'], 'Regional': df_resultado_final['Regional_Sigla'],
+        'SC Destino': df_resultado_final[COLUNA_SC_DESTINO], 'Base que escaneou': df_resultado_final['chave_E_gb'], 'Registrante': registrante,
+        'Turno registrante': turno, 'horário de execução': horario_execucao, 'Status': 'Pendente de baixa'
+    })
+    # Em colunas de categoria o map roda só sobre os valores distintos, não linha a linha.
+    df_base['SC Destino'] = df_base['SC Destino'].map(lambda sc: 'SP - SÃO PAULO' if sc == 'SP BRE' else sc, na_action='ignore')
+    df_base['Localização Mapa'] = df_base['Regional'].map(lambda sigla: mapa_estados.get(sigla, sigla) + ', Brazil', na_action='ignore')
+    ordem_colunas_sheets = [
+        'PEDIDOS', 'Tipo de bipagem', 'Regional', 'Localização Mapa', 'SC Destino', 'Base que escaneou', 'Registrante', 'Turno registrante', 'horário de execução', 'Status'
+    ]
+    df_para_sheets = df_base[ordem_colunas_sheets]
+    df_consolidado_local = df_para_sheets.drop(columns=['Status'])
+    df_para_arquivos_divididos = pd.DataFrame({
+        'Número da carta de porte': df_resultado_final[coluna_pedido], 'operação': 'Transit', 'Primeiro nível codificação': regra['primeiro_nivel'],
+        'Nível II codificação': regra['segundo_nivel'], 'causa do problema': regra['causa']
+    })
+    return df_para_sheets, df_consolidado_local, df_para_arquivos_divididos
+
+def escrever_tabela(df, caminho_saida, formato):
+    if formato == 'parquet':
+        df.to_parquet(caminho_saida, index=False)
+    elif formato == 'csv':
+        # utf-8-sig para o Excel abrir os acentos e o chinês corretamente.
+        df.to_csv(caminho_saida, index=False, encoding='utf-8-sig')
+    elif xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(caminho_saida, {'constant_memory': True})
+        planilha = workbook.add_worksheet('Sheet1')
+        planilha.write_row(0, 0, [str(coluna) for coluna in df.columns])
+        for numero_linha, linha in enumerate(sem_nulos(df).itertuples(index=False), start=1):
+            planilha.write_row(numero_linha, 0, linha)
+        workbook.close()
     else:
-        df_gb_para_merge = df_gb_filtrado[[0, 4, 78]].copy()
-        df_gb_para_merge.columns = ['chave_A_gb', 'chave_E_gb', 'Regional_Sigla']
-        df_resultado_final = pd.merge(df_pedidos, df_gb_para_merge, left_on=[0, 2], right_on=['chave_A_gb', 'chave_E_gb'], how='inner')
-        print(f"SUCESSO: O cruzamento resultou em {len(df_resultado_final)} pedidos a serem exportados.")
-        
-        if len(df_resultado_final) > 0:
-            horario_execucao = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-
-            # [PASSO 4] Preparação das 3 tabelas de saída diferentes
-            print("\n[PASSO 4 de 7] Preparando os diferentes formatos de relatório...")
-            df_base = pd.DataFrame({
-                'PEDIDOS': df_resultado_final[0], 'Tipo de bipagem': 'Encomenda expedido mas não chegou (有发未到件)', 'Regional': df_resultado_final['Regional_Sigla'],
-                'SC Destino': df_resultado_final[3], 'Base que escaneou': df_resultado_final['chave_E_gb'], 'Registrante': registrante,
-                'Turno registrante': turno, 'horário de execução': horario_execucao, 'Status': 'Pendente de baixa'
-            })
-            df_base['SC Destino'] = df_base['SC Destino'].replace('SP BRE', 'SP - SÃO PAULO')
-            df_base['Localização Mapa'] = df_base['Regional'].map(mapa_estados).fillna(df_base['Regional']) + ', Brazil'
-            ordem_colunas_sheets = [
-                'PEDIDOS', 'Tipo de bipagem', 'Regional', 'Localização Mapa', 'SC Destino', 'Base que escaneou', 'Registrante', 'Turno registrante', 'horário de execução', 'Status'
-            ]
-            df_para_sheets = df_base[ordem_colunas_sheets]
-            df_consolidado_local = df_para_sheets.drop(columns=['Status'])
-            df_para_arquivos_divididos = pd.DataFrame({
-                'Número da carta de porte': df_resultado_final[0], 'operação': 'Transit', 'Primeiro nível codificação': 'N00',
-                'Nível II codificação': 'N29', 'causa do problema': 'Sem recebimento no SC'
-            })
-
-            # [PASSO 5] Salvamento de arquivos locais
-            print("\n[PASSO 5 de 7] Salvando os resultados locais...")
-            timestamp_pasta = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            pasta_saida_final = os.path.join(pasta_resultado, timestamp_pasta)
-            os.makedirs(pasta_saida_final, exist_ok=True)
-            print(f"  -> Resultados locais serão salvos na pasta: {pasta_saida_final}")
-            num_arquivos = math.ceil(len(df_para_arquivos_divididos) / linhas_por_arquivo)
-            for i in range(num_arquivos):
-                inicio = i * linhas_por_arquivo
-                fim = inicio + linhas_por_arquivo
-                df_pedaco = df_para_arquivos_divididos.iloc[inicio:fim]
-                nome_arquivo = f"pedidos_filtrados_parte_{i+1}.xlsx"
-                caminho_saida = os.path.join(pasta_saida_final, nome_arquivo)
-                df_pedaco.to_excel(caminho_saida, index=False)
-                print(f"    -> Arquivo dividido '{nome_arquivo}' (formato N00/N29) salvo.")
-            caminho_consolidado_local = os.path.join(pasta_saida_final, "consolidado_geral.xlsx")
-            df_consolidado_local.to_excel(caminho_consolidado_local, index=False)
-            print(f"    -> Arquivo consolidado local 'consolidado_geral.xlsx' salvo.")
-
-            # [PASSO 6] Enviar para o Sheets
-            enviar_para_sheets(df_para_sheets)
-        else:
-            print("  -> Nenhum resultado a ser salvo ou enviado.")
+        df.to_excel(caminho_saida, index=False)
+    return caminho_saida
+
+def salvar_resultados_locais(df_para_arquivos_divididos, df_consolidado_local, timestamp_pasta=None, subpasta=''):
+    print("\n[PASSO 5 de 7] Salvando os resultados locais...")
+    timestamp_pasta = timestamp_pasta or datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    pasta_saida_final = os.path.join(pasta_resultado, timestamp_pasta, subpasta)
+    os.makedirs(pasta_saida_final, exist_ok=True)
+    print(f"  -> Resultados locais serão salvos na pasta: {pasta_saida_final}")
+    num_arquivos = math.ceil(len(df_para_arquivos_divididos) / linhas_por_arquivo)
+    tarefas = []
+    for i in range(num_arquivos):
+        inicio = i * linhas_por_arquivo
+        fim = inicio + linhas_por_arquivo
+        nome_arquivo = f"pedidos_filtrados_parte_{i+1}.{formato_saida}"
+        tarefas.append((df_para_arquivos_divididos.iloc[inicio:fim], nome_arquivo, "    -> Arquivo dividido '{}' salvo."))
+    tarefas.append((df_consolidado_local, f"consolidado_geral.{formato_saida}", "    -> Arquivo consolidado local '{}' salvo."))
+    # Cada arquivo é independente, então são gravados em paralelo, um processo por arquivo.
+    with ProcessPoolExecutor(max_workers=processos_de_escrita) as executor:
+        futuros = [
+            (executor.submit(escrever_tabela, df, os.path.join(pasta_saida_final, nome_arquivo), formato_saida), nome_arquivo, mensagem)
+            for df, nome_arquivo, mensagem in tarefas
+        ]
+        for futuro, nome_arquivo, mensagem in futuros:
+            futuro.result()
+            print(mensagem.format(nome_arquivo))
+    return pasta_saida_final
+
+def exportar_resultado_da_regra(df_resultado_final, regra, registrante, turno, timestamp_execucao, subpasta, relatorio, conexao_indice, pedidos_exportados):
+    nome_regra = regra['nome']
+    caminho_checkpoint = caminho_checkpoint_da_regra(nome_regra)
+    # Pedidos de um envio pendente contam como exportados: senão entrariam duas vezes no Sheets.
+    pedidos_pendentes = pedidos_do_checkpoint(caminho_checkpoint)
+    df_resultado_final = filtrar_pedidos_ja_exportados(
+        df_resultado_final, pedidos_exportados.get(nome_regra, set()) | pedidos_pendentes, regra['colunas_pedidos'][0]
+    )
+    relatorio['pedidos_novos'][nome_regra] = len(df_resultado_final)
+    print(f"SUCESSO: O cruzamento da regra '{nome_regra}' resultou em {len(df_resultado_final)} pedidos a serem exportados.")
+    if len(df_resultado_final) == 0:
+        print("  -> Nenhum resultado a ser salvo ou enviado.")
+        if pedidos_pendentes:
+            enviar_e_registrar(df_resultado_final.iloc[0:0], regra, caminho_checkpoint, relatorio, conexao_indice, pedidos_exportados)
+        return
+    horario_execucao = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+
+    # [PASSO 4] Preparação das 3 tabelas de saída diferentes
+    with medir_passo(relatorio, 'PASSO 4', nome_regra) as medida:
+        medida['linhas_entrada'] = len(df_resultado_final)
+        df_para_sheets, df_consolidado_local, df_para_arquivos_divididos = preparar_relatorios(
+            df_resultado_final, registrante, turno, horario_execucao, regra
+        )
+        medida['linhas_saida'] = len(df_para_sheets)
+
+    # [PASSO 5] Salvamento de arquivos locais
+    with medir_passo(relatorio, 'PASSO 5', nome_regra) as medida:
+        medida['linhas_entrada'] = len(df_para_arquivos_divididos)
+        relatorio['pastas_saida'][nome_regra] = salvar_resultados_locais(
+            df_para_arquivos_divididos, df_consolidado_local, timestamp_execucao, subpasta
+        )
+
+    # [PASSO 6] Enviar para o Sheets
+    enviar_e_registrar(df_para_sheets, regra, caminho_checkpoint, relatorio, conexao_indice, pedidos_exportados)
+
+def enviar_e_registrar(df_para_sheets, regra, caminho_checkpoint, relatorio, conexao_indice, pedidos_exportados):
+    with medir_passo(relatorio, 'PASSO 6', regra['nome']) as medida:
+        medida['linhas_entrada'] = len(df_para_sheets)
+        medida['linhas_saida'] = 0
+        for df_enviado in enviar_para_sheets(df_para_sheets, caminho_checkpoint=caminho_checkpoint, aba=regra['aba_sheets'], regra=regra['nome']):
+            medida['linhas_saida'] += len(df_enviado)
+            # Linhas retomadas de outra execução trazem o registrante, o turno e o horário daquela execução.
+            colunas_do_registro = ['Registrante', 'Turno registrante', 'horário de execução']
+            for (registrante, turno, horario), df_registro in df_enviado.groupby(colunas_do_registro, sort=False):
+                registrar_pedidos_exportados(
+                    conexao_indice, pedidos_exportados, df_registro['PEDIDOS'], registrante, turno, horario, regra['nome']
+                )
+
+def executar_cruzamento(registrante, turno, conexao_indice, pedidos_exportados, regras=None):
+    regras = validar_regras(regras or REGRAS_DE_CRUZAMENTO)
+    hashes_calculados.clear()
+    timestamp_execucao = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    relatorio = novo_relatorio_execucao(registrante, turno)
+    relatorio['regras'] = [regra['nome'] for regra in regras]
+    relatorio['pedidos_novos'], relatorio['pastas_saida'] = {}, {}
+
+    # [PASSOS 1 a 3] Carregamento, limpeza e cruzamento de todas as regras sobre uma única leitura
+    arquivos_pedidos = glob.glob(os.path.join(pasta_pedidos, '*.xls'))
+    arquivos_gb = glob.glob(os.path.join(pasta_gb, '*.xlsx'))
+    if ignorar_arquivos_repetidos and entradas_ja_processadas(arquivos_pedidos, arquivos_gb):
+        print("\nAVISO: Todas as exportações têm o mesmo conteúdo de arquivos já processados. Nada a cruzar.")
+        relatorio['entradas_repetidas'] = True
+        resultados, lista_arquivos_pedidos, lista_arquivos_gb = None, arquivos_pedidos, arquivos_gb
+    elif memoria_maxima_mb:
+        resultados, lista_arquivos_pedidos, lista_arquivos_gb = carregar_e_cruzar_fora_da_memoria(memoria_maxima_mb, relatorio, regras)
+    else:
+        resultados, lista_arquivos_pedidos, lista_arquivos_gb = carregar_e_cruzar_em_memoria(relatorio, regras)
+
+    # [PASSOS 4 a 6] Relatórios de cada regra; com mais de uma regra, cada uma ganha sua subpasta no resultado
+    for regra in regras:
+        df_resultado_final = resultados.get(regra['nome']) if resultados is not None else None
+        if df_resultado_final is None:
+            continue
+        subpasta = regra['nome'] if len(regras) > 1 else ''
+        exportar_resultado_da_regra(
+            df_resultado_final, regra, registrante, turno, timestamp_execucao, subpasta, relatorio, conexao_indice, pedidos_exportados
+        )
+
+    # [PASSO 7] arquivamento dos arquivos de entrada
+    if lista_arquivos_pedidos or lista_arquivos_gb:
+        with medir_passo(relatorio, 'PASSO 7') as medida:
+            medida['arquivos'] = len(lista_arquivos_pedidos) + len(lista_arquivos_gb)
+            arquivar_arquivos_processados(lista_arquivos_pedidos, lista_arquivos_gb, timestamp_execucao)
+
+    gravar_relatorio_execucao(relatorio, timestamp_execucao)
+    print("\n--- PROCESSO FINALIZADO ---")
+    return relatorio
+
+
+# --- MODO DAEMON (PASTAS OBSERVADAS) ---
+
+class AvisoDeMudanca(FileSystemEventHandler):
+    def __init__(self, evento):
+        self.evento = evento
+
+    def on_any_event(self, event):
+        self.evento.set()
+
+def retrato_das_pastas():
+    # Tamanho e data de cada arquivo de entrada; iguais no início e no fim de um intervalo sem avisos, a cópia terminou.
+    retrato = {}
+    for pasta, extensao in ((pasta_pedidos, 'xls'), (pasta_gb, 'xlsx')):
+        for arquivo in glob.glob(os.path.join(pasta, f'*.{extensao}')):
+            if os.path.basename(arquivo).startswith('~$'):
+                continue
+            try:
+                info = os.stat(arquivo)
+            except FileNotFoundError:
+                continue
+            retrato[arquivo] = (info.st_size, info.st_mtime_ns)
+    return retrato
+
+def par_completo(retrato):
+    tem_pedidos = any(arquivo.endswith('.xls') for arquivo in retrato)
+    tem_gb = any(arquivo.endswith('.xlsx') for arquivo in retrato)
+    return tem_pedidos and tem_gb
+
+def executar_daemon(registrante, turno, intervalo_segundos, regras=None):
+    print(f"--- MODO DAEMON: observando '{pasta_pedidos}' e '{pasta_gb}' (registrante {registrante}, turno {turno}) ---")
+    evento = threading.Event()
+    observador = None
+    if Observer is not None:
+        observador = Observer()
+        for pasta in (pasta_pedidos, pasta_gb):
+            observador.schedule(AvisoDeMudanca(evento), pasta, recursive=False)
+        observador.start()
+        print("  -> Aguardando avisos do sistema de arquivos (inotify).")
+    else:
+        print(f"  -> watchdog não instalado. Verificando as pastas a cada {intervalo_segundos}s.")
+    conexao_indice, pedidos_exportados = abrir_indice_exportados(ARQUIVO_INDICE_EXPORTADOS)
+    ultimo_processado = None
+    try:
+        while True:
+            evento.wait(timeout=intervalo_segundos)
+            evento.clear()
+            retrato = retrato_das_pastas()
+            if not par_completo(retrato) or retrato == ultimo_processado:
+                continue
+            # Cópia terminada = um intervalo inteiro sem mudanças: cada aviso do sistema recomeça a espera e o
+            # retrato do fim do intervalo tem de ser igual ao do início (sem watchdog, só essa comparação vale).
+            while True:
+                houve_aviso = evento.wait(timeout=intervalo_segundos)
+                evento.clear()
+                retrato_seguinte = retrato_das_pastas()
+                if not houve_aviso and retrato_seguinte == retrato:
+                    break
+                retrato = retrato_seguinte
+            if not par_completo(retrato) or retrato == ultimo_processado:
+                continue
+            print(f"\n--- Novo par de exportações detectado ({datetime.now().strftime('%d/%m/%Y %H:%M:%S')}) ---")
+            try:
+                executar_cruzamento(registrante, turno, conexao_indice, pedidos_exportados, regras)
+            except Exception:
+                # Uma exportação corrompida não derruba o daemon: o erro fica no log e este retrato não é reprocessado.
+                print("\nERRO: A execução falhou; os arquivos continuam nas pastas. Detalhes:")
+                traceback.print_exc()
+            ultimo_processado = retrato
+    except KeyboardInterrupt:
+        print("\n--- MODO DAEMON ENCERRADO ---")
+    finally:
+        if observador is not None:
+            observador.stop()
+            observador.join()
+        conexao_indice.close()
+
+
+# --- FLUXO PRINCIPAL DO SCRIPT ---
+
+def perguntar_registro():
+    # --- COLETA DE INFORMAÇÕES DO USUÁRIO (COM MENU INTERATIVO) ---
+    import questionary
+    print("--- Por favor, selecione as informações do registro ---")
+
+    registrante = questionary.text(
+        "Qual o seu nome?",
+        validate=lambda text: True if len(text) > 0 else "O nome é obrigatório. Por favor, tente novamente."
+    ).ask().title()
+
+    turno = questionary.select(
+        "Qual o seu turno?",
+        choices=[
+            "T1",
+            "T2",
+            "T3"
+        ]
+    ).ask()
+
+    print(f"\nObrigado, {registrante}! Iniciando a automação para o turno {turno}...\n")
+    return registrante, turno
+
+def ler_argumentos():
+    parser = argparse.ArgumentParser(description="Robô de cruzamento: expedido mas não chegou.")
+    parser.add_argument('--registrante', help="Nome de quem registra (dispensa a pergunta interativa).")
+    parser.add_argument('--turno', choices=['T1', 'T2', 'T3'], help="Turno do registrante.")
+    parser.add_argument('--config', help="Arquivo JSON com 'registrante', 'turno' e, opcionalmente, 'intervalo' e 'regras'.")
+    parser.add_argument('--daemon', action='store_true', help="Fica observando as pastas e processa cada novo par de exportações.")
+    parser.add_argument('--intervalo', type=int, help="Segundos sem mudanças nas pastas antes de processar (modo daemon).")
+    parser.add_argument('--formato-saida', choices=['xlsx', 'csv', 'parquet'], help="Formato dos arquivos locais (padrão: xlsx).")
+    parser.add_argument('--regras', help="Arquivo JSON com a lista de regras de cruzamento (padrão: REGRAS_DE_CRUZAMENTO).")
+    parser.add_argument('--memoria-maxima-mb', type=int, help="Lê e cruza em partições no disco dentro desse orçamento de memória (o resultado fica em memória).")
+    args = parser.parse_args()
+    config = ler_json(args.config) if args.config else {}
+    args.registrante = args.registrante or config.get('registrante')
+    args.turno = args.turno or config.get('turno')
+    args.intervalo = args.intervalo or config.get('intervalo') or intervalo_daemon_segundos
+    args.regras = ler_json(args.regras) if args.regras else config.get('regras')
+    return args
+
+# O fluxo fica protegido pelo __main__ para que os processos de leitura possam importar este módulo.
+def main():
+    global memoria_maxima_mb, formato_saida
+    args = ler_argumentos()
+    memoria_maxima_mb = args.memoria_maxima_mb or memoria_maxima_mb
+    formato_saida = args.formato_saida or formato_saida
+    regras = validar_regras(args.regras or REGRAS_DE_CRUZAMENTO)
+    if args.daemon:
+        if not args.registrante or not args.turno:
+            raise SystemExit("ERRO: o modo daemon exige --registrante e --turno (ou um --config com esses campos).")
+        executar_daemon(args.registrante.title(), args.turno, args.intervalo, regras)
+        return
+
+    if args.registrante and args.turno:
+        registrante, turno = args.registrante.title(), args.turno
+    else:
+        registrante, turno = perguntar_registro()
+    print("--- INICIANDO ROBÔ DE CRUZAMENTO DE DADOS (VERSÃO FINAL) ---")
+    conexao_indice, pedidos_exportados = abrir_indice_exportados(ARQUIVO_INDICE_EXPORTADOS)
+    try:
+        executar_cruzamento(registrante, turno, conexao_indice, pedidos_exportados, regras)
+    finally:
+        conexao_indice.close()
 
-# [PASSO 7] arquivamento dos arquivos de entrada
-if lista_arquivos_pedidos or lista_arquivos_gb:
-    arquivar_arquivos_processados(lista_arquivos_pedidos, lista_arquivos_gb)
 
-print("\n--- PROCESSO FINALIZADO ---")
+if __name__ == '__main__':
+    main()
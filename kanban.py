@@ -1,15 +1,865 @@
 import re
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
+import io
+import csv
+import math
+import time
+import hashlib
+import threading
+import click
+from collections import deque
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app, stream_with_context
 from ..utils import login_required, log_action, get_shift_name_from_hour, get_shift_boundaries
-from sqlalchemy import case, desc
-from datetime import datetime
+from sqlalchemy import case, desc, func, and_, or_, select, union_all, literal, literal_column, null, tuple_, type_coerce, inspect, insert, update, bindparam, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, date
 from ..models import db, Veiculo, VeiculoHistorico
 
 
 kanban_bp = Blueprint('kanban', __name__)
 
+HORAS_ALERTA = 2
+HORAS_ATRASO = 4
+
+# Duração da descarga em segundos; o texto "Xh Ym" de tempo_descarga fica só para exibição. Enquanto os
+# modelos (em ..models, fora deste módulo) não declaram a coluna, ela é acrescentada aqui; no banco, é criada e
+# preenchida pela migração `flask kanban preparar-banco` (_migrar_tempo_descarga_segundos).
+for _modelo in (Veiculo, VeiculoHistorico):
+    if not hasattr(_modelo, 'tempo_descarga_segundos'):
+        _modelo.tempo_descarga_segundos = db.Column(db.Integer)
+indices_tempo_descarga = [
+    db.Index(f'ix_{_modelo.__tablename__}_tempo_descarga_segundos', _modelo.tempo_descarga_segundos)
+    for _modelo in (Veiculo, VeiculoHistorico)
+]
+
+# Ordem do quadro: agrupa por status e, dentro de cada grupo, data, início e finalização (mais nova primeiro).
+# Constantes em literal_column: com parâmetros (status = ?) o ORDER BY não casa com a expressão do índice.
+status_order = case(
+    (Veiculo.status == literal_column("'AGUARDANDO'"), literal_column('1')),
+    (Veiculo.status == literal_column("'EM_PROCESSO'"), literal_column('2')),
+    (Veiculo.status == literal_column("'FINALIZADO'"), literal_column('3')),
+    else_=literal_column('4')
+)
+ORDEM_DO_QUADRO = (status_order, Veiculo.data.asc(), Veiculo.hora_inicio.asc(), desc(Veiculo.horario_atualizacao))
+
+# Índice composto com a mesma expressão e a mesma ordem do ORDER BY: o banco entrega o quadro já ordenado.
+indice_quadro = db.Index('ix_veiculo_quadro', *ORDEM_DO_QUADRO)
+
+
+classe_finalizacao = case(
+    (Veiculo.status != 'FINALIZADO', 'status-ok'),
+    (Veiculo.tempo_descarga_segundos >= HORAS_ATRASO * 3600, 'status-atrasado'),
+    (Veiculo.tempo_descarga_segundos >= HORAS_ALERTA * 3600, 'status-alerta'),
+    else_='status-ok'
+)
+
+
+def _classe_finalizacao(veiculo):
+    """
+    Mesma regra de `classe_finalizacao`, para um veículo já carregado.
+    """
+    segundos = veiculo.tempo_descarga_segundos
+    if veiculo.status != 'FINALIZADO' or segundos is None:
+        return 'status-ok'
+    if segundos >= HORAS_ATRASO * 3600:
+        return 'status-atrasado'
+    if segundos >= HORAS_ALERTA * 3600:
+        return 'status-alerta'
+    return 'status-ok'
+
+
+def _segundos_do_texto_de_descarga(texto):
+    """
+    "Xh Ym" -> segundos; None se vazio ou fora do formato.
+    """
+    encontrado = re.match(r'^\s*(\d+(?:\.\d+)?)\s*h(?:\s*(\d+)\s*m)?\s*$', texto or '')
+    if not encontrado:
+        return None
+    return int(float(encontrado.group(1)) * 3600) + int(encontrado.group(2) or 0) * 60
+
+
+def _migrar_tempo_descarga_segundos():
+    """
+    Cria a coluna tempo_descarga_segundos onde ainda não existe, preenche-a a partir do texto e cria os índices.
+    """
+    inspetor = inspect(db.engine)
+    for modelo, indice in zip((Veiculo, VeiculoHistorico), indices_tempo_descarga):
+        tabela = modelo.__table__
+        if 'tempo_descarga_segundos' not in {coluna['name'] for coluna in inspetor.get_columns(tabela.name)}:
+            nome_tabela = db.engine.dialect.identifier_preparer.format_table(tabela)
+            with db.engine.begin() as conexao:
+                conexao.execute(text(f'ALTER TABLE {nome_tabela} ADD COLUMN tempo_descarga_segundos INTEGER'))
+            consulta = db.session.execute(
+                select(modelo.id, modelo.tempo_descarga).where(modelo.tempo_descarga.isnot(None))
+                .execution_options(yield_per=LINHAS_POR_LOTE_DE_INDEXACAO)
+            )
+            for lote in consulta.partitions():
+                valores = [
+                    {'id_linha': veiculo_id, 'segundos': _segundos_do_texto_de_descarga(tempo)} for veiculo_id, tempo in lote
+                ]
+                valores = [valor for valor in valores if valor['segundos'] is not None]
+                if valores:
+                    db.session.execute(
+                        update(tabela).where(tabela.c.id == bindparam('id_linha')).values(tempo_descarga_segundos=bindparam('segundos')),
+                        valores
+                    )
+            db.session.commit()
+        with db.engine.begin() as conexao:
+            conexao.execute(CreateIndex(indice, if_not_exists=True))
+
+
+def _contadores_do_quadro(agora):
+    """
+    Contagem por status e faixas de tempo dos veículos em processo, numa única consulta agregada.
+    """
+    em_processo = Veiculo.status == 'EM_PROCESSO'
+    limite_alerta = agora - timedelta(hours=HORAS_ALERTA)
+    limite_atraso = agora - timedelta(hours=HORAS_ATRASO)
+    linha = db.session.query(
+        func.count(case((Veiculo.status == 'AGUARDANDO', 1))),
+        func.count(case((em_processo, 1))),
+        func.count(case((Veiculo.status == 'FINALIZADO', 1))),
+        func.count(case((and_(em_processo, Veiculo.hora_inicio > limite_alerta), 1))),
+        func.count(case((and_(em_processo, Veiculo.hora_inicio <= limite_alerta, Veiculo.hora_inicio > limite_atraso), 1))),
+        func.count(case((and_(em_processo, Veiculo.hora_inicio <= limite_atraso), 1))),
+    ).one()
+    kanban_counts = {'aguardando': linha[0], 'em_processo': linha[1], 'finalizado': linha[2]}
+    processo_contadores = {'ok': linha[3], 'alerta': linha[4], 'atrasado': linha[5]}
+    return kanban_counts, processo_contadores
+
+
+# --- CACHE DO QUADRO ---
+# Snapshots das APIs de polling, servidos sem SQL enquanto a versão do quadro não muda e até o próximo
+# instante em que o tempo muda a resposta (faixa de tempo de uma doca, fim do turno). A versão é o id da
+# última entrada do diário de alterações (AlteracaoQuadro), a mesma de /api/board e dos ids dos eventos:
+# avança com _quadro_alterado após cada commit do processo e com o leitor do diário para as alterações
+# feitas por outros processos. SEGUNDOS_MAXIMOS_DO_SNAPSHOT limita o tempo de vida de cada snapshot.
+SEGUNDOS_MAXIMOS_DO_SNAPSHOT = 5
+_trava_do_cache = threading.Lock()
+_cache_do_quadro = {'versao': 0, 'snapshots': {}}
+
+# --- EVENTOS DO QUADRO (SERVER-SENT EVENTS) ---
+# Os eventos vêm do diário de alterações (AlteracaoQuadro), compartilhado por todos os processos do
+# servidor: em cada processo, uma única thread lê as entradas novas do diário (na hora, quando a alteração
+# é do próprio processo; senão a cada SEGUNDOS_ENTRE_LEITURAS_DO_DIARIO) e as guarda em memória. O id de
+# cada evento é o id da entrada no diário, o mesmo de /api/board?since=. Os últimos EVENTOS_GUARDADOS
+# ficam em memória para que um cliente que reconecta com Last-Event-ID receba só o que perdeu.
+EVENTOS_GUARDADOS = 500
+SEGUNDOS_ENTRE_HEARTBEATS = 15
+SEGUNDOS_POR_CONEXAO = 600
+SEGUNDOS_ENTRE_LEITURAS_DO_DIARIO = 2
+ENTRADAS_POR_LEITURA_DO_DIARIO = 500
+_eventos_do_quadro = deque(maxlen=EVENTOS_GUARDADOS)
+_novo_evento = threading.Condition(_trava_do_cache)
+_diario_lido = {'versao': None, 'leitor': None}
+_diario_alterado = threading.Event()
+
+
+def _formatar_evento(versao, tipo, dados):
+    return f"id: {versao}\nevent: {tipo}\ndata: {current_app.json.dumps(dados)}\n\n"
+
+
+def _quadro_alterado(tipo, dados):
+    """
+    Chamada após o commit de cada alteração (uma vez por lote): avança a versão do quadro até a última
+    entrada do diário, invalidando os snapshots, e acorda o leitor do diário.
+    """
+    versao = db.session.query(func.max(AlteracaoQuadro.id)).scalar() or 0
+    _avancar_versao(versao)
+    _diario_alterado.set()
+    _sincronizar_docas(tipo, dados)
+    return versao
+
+
+def _avancar_versao(versao):
+    with _trava_do_cache:
+        if versao > _cache_do_quadro['versao']:
+            _cache_do_quadro['versao'] = versao
+            _cache_do_quadro['snapshots'].clear()
+
+
+def _eventos_do_diario(desde):
+    """
+    Eventos formatados das entradas do diário posteriores a `desde` (até ENTRADAS_POR_LEITURA_DO_DIARIO).
+    Entradas seguidas de arquivamento viram um único evento 'veiculos_arquivados'.
+    """
+    entradas = (
+        db.session.query(AlteracaoQuadro.id, AlteracaoQuadro.veiculo_id, AlteracaoQuadro.tipo)
+        .filter(AlteracaoQuadro.id > desde).order_by(AlteracaoQuadro.id).limit(ENTRADAS_POR_LEITURA_DO_DIARIO).all()
+    )
+    ids_alterados = {veiculo_id for _, veiculo_id, tipo in entradas if tipo == 'alterado'}
+    veiculos = {veiculo.id: veiculo for veiculo in Veiculo.query.filter(Veiculo.id.in_(ids_alterados))} if ids_alterados else {}
+    eventos, arquivados = [], []
+    for posicao, (versao, veiculo_id, tipo) in enumerate(entradas):
+        if tipo == 'arquivado':
+            arquivados.append(veiculo_id)
+            if posicao + 1 == len(entradas) or entradas[posicao + 1][2] != 'arquivado':
+                eventos.append((versao, _formatar_evento(versao, 'veiculos_arquivados', {'veiculo_ids': arquivados})))
+                arquivados = []
+        elif tipo == 'removido':
+            eventos.append((versao, _formatar_evento(versao, 'veiculo_removido', {'veiculo_id': veiculo_id})))
+        elif veiculo_id in veiculos:
+            # Um veículo que já não está no quadro terá uma entrada posterior de remoção ou arquivamento.
+            dados = {'success': True, 'veiculo': _serializar_veiculo(veiculos[veiculo_id])}
+            eventos.append((versao, _formatar_evento(versao, 'veiculo', dados)))
+    return eventos, entradas[-1][0] if entradas else desde
+
+
+def _ler_diario(app):
+    while True:
+        _diario_alterado.wait(timeout=SEGUNDOS_ENTRE_LEITURAS_DO_DIARIO)
+        _diario_alterado.clear()
+        try:
+            with app.app_context():
+                while True:
+                    eventos, versao = _eventos_do_diario(_diario_lido['versao'])
+                    with _novo_evento:
+                        _eventos_do_quadro.extend(eventos)
+                        _diario_lido['versao'] = versao
+                        _novo_evento.notify_all()
+                    _avancar_versao(versao)
+                    if len(eventos) < ENTRADAS_POR_LEITURA_DO_DIARIO:
+                        break
+        except Exception:
+            app.logger.exception('Falha ao ler o diário de alterações do quadro.')
+
+
+def _iniciar_leitor_do_diario():
+    # Iniciado na primeira consulta de cada processo (depois do fork dos workers), a partir da versão atual.
+    with _novo_evento:
+        if _diario_lido['leitor'] is not None:
+            return
+        _diario_lido['versao'] = db.session.query(func.max(AlteracaoQuadro.id)).scalar() or 0
+        if _diario_lido['versao'] > _cache_do_quadro['versao']:
+            _cache_do_quadro['versao'] = _diario_lido['versao']
+            _cache_do_quadro['snapshots'].clear()
+        _diario_lido['leitor'] = threading.Thread(
+            target=_ler_diario, args=(current_app._get_current_object(),), name='diario-kanban', daemon=True
+        )
+        _diario_lido['leitor'].start()
+
+
+def _serializar_veiculo(veiculo):
+    return {
+        'id': veiculo.id,
+        'placa': veiculo.placa,
+        'origem': veiculo.origem,
+        'id_viagem': veiculo.id_viagem,
+        'doca': veiculo.doca,
+        'turno': veiculo.turno,
+        'tipo_veiculo': veiculo.tipo_veiculo,
+        'tipo_carga': veiculo.tipo_carga,
+        'status': veiculo.status,
+        'hora_inicio': veiculo.hora_inicio.isoformat() if veiculo.hora_inicio else None,
+        'horario_atualizacao': veiculo.horario_atualizacao.isoformat() if veiculo.horario_atualizacao else None,
+        'turno_finalizacao': veiculo.turno_finalizacao,
+        'tempo_descarga': veiculo.tempo_descarga,
+        'tempo_descarga_segundos': veiculo.tempo_descarga_segundos,
+        'finalization_status_class': _classe_finalizacao(veiculo)
+    }
+
+
+def _veiculo_alterado(veiculo):
+    _quadro_alterado('veiculo', {'success': True, 'veiculo': _serializar_veiculo(veiculo)})
+
+
+def _eventos_a_partir_de(ultimo_id):
+    """
+    Gera os eventos posteriores a `ultimo_id` e depois os novos, com um heartbeat quando nada acontece.
+    """
+    yield "retry: 3000\n\n"
+    with _novo_evento:
+        versao = _diario_lido['versao']
+        mais_antigo = _eventos_do_quadro[0][0] if _eventos_do_quadro else versao + 1
+    if ultimo_id is None:
+        ultimo_id = versao
+    elif ultimo_id > versao or ultimo_id < mais_antigo - 1:
+        # Eventos perdidos (servidor reiniciado ou cliente desconectado por tempo demais): recarregar tudo.
+        yield f"id: {versao}\nevent: recarregar\ndata: {{}}\n\n"
+        ultimo_id = versao
+    # A conexão é encerrada de tempos em tempos; o navegador reconecta sozinho com o Last-Event-ID.
+    fim = time.monotonic() + SEGUNDOS_POR_CONEXAO
+    while time.monotonic() < fim:
+        with _novo_evento:
+            pendentes = [evento for evento in _eventos_do_quadro if evento[0] > ultimo_id]
+            if not pendentes:
+                _novo_evento.wait(timeout=SEGUNDOS_ENTRE_HEARTBEATS)
+                pendentes = [evento for evento in _eventos_do_quadro if evento[0] > ultimo_id]
+        if not pendentes:
+            yield ": heartbeat\n\n"
+            continue
+        for versao, texto in pendentes:
+            yield texto
+        ultimo_id = pendentes[-1][0]
+
+
+def _snapshot(nome, construir):
+    """
+    Devolve o snapshot `nome` ({'corpo', 'etag', 'expira_em'}), reconstruído por `construir(agora)` quando
+    a versão do quadro mudou ou o snapshot expirou. `construir` devolve (dados, instante de expiração ou None).
+    """
+    _iniciar_leitor_do_diario()
+    agora = datetime.now()
+    with _trava_do_cache:
+        versao = _cache_do_quadro['versao']
+        snapshot = _cache_do_quadro['snapshots'].get(nome)
+    if snapshot is not None and agora < snapshot['expira_em']:
+        return snapshot
+
+    dados, expira_em = construir(agora)
+    limite = agora + timedelta(seconds=SEGUNDOS_MAXIMOS_DO_SNAPSHOT)
+    corpo = current_app.json.dumps(dados)
+    snapshot = {
+        'corpo': corpo,
+        # Derivado do conteúdo: igual entre processos do servidor e entre reconstruções sem mudança.
+        'etag': hashlib.sha1(corpo.encode('utf-8')).hexdigest(),
+        'expira_em': min(expira_em, limite) if expira_em else limite,
+    }
+    with _trava_do_cache:
+        if _cache_do_quadro['versao'] == versao:
+            _cache_do_quadro['snapshots'][nome] = snapshot
+    return snapshot
+
+
+def _responder_snapshot(snapshot):
+    resposta = current_app.response_class(snapshot['corpo'], mimetype='application/json')
+    resposta.set_etag(snapshot['etag'])
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta.make_conditional(request)
+
+
+# --- OCUPAÇÃO DAS DOCAS ---
+# Mapa doca -> id do veículo ativo, atualizado por _quadro_alterado após cada commit, mais as reservas de
+# cadastros ainda não gravados. O índice único parcial uq_veiculo_doca_ativa garante no banco o que o mapa
+# verifica em memória: uma reserva aceita pelo mapa desatualizado de outro processo falha no commit.
+# Como os snapshots, o mapa é recarregado após SEGUNDOS_MAXIMOS_DO_SNAPSHOT.
+DOCAS = list(range(1, 31)) + list(range(61, 91))
+STATUS_NA_DOCA = ('AGUARDANDO', 'EM_PROCESSO')
+doca_ativa = and_(Veiculo.doca.isnot(None), Veiculo.doca != '', Veiculo.status.in_(STATUS_NA_DOCA))
+indice_doca_ativa = db.Index(
+    'uq_veiculo_doca_ativa', Veiculo.doca, unique=True, sqlite_where=doca_ativa, postgresql_where=doca_ativa
+)
+_trava_das_docas = threading.Lock()
+_ocupacao_das_docas = {'docas': None, 'carregado_em': 0.0, 'reservas': {}}
+
+
+def _docas_em_memoria():
+    # Chamada com _trava_das_docas.
+    if _ocupacao_das_docas['docas'] is None or time.monotonic() - _ocupacao_das_docas['carregado_em'] > SEGUNDOS_MAXIMOS_DO_SNAPSHOT:
+        linhas = db.session.execute(select(Veiculo.doca, Veiculo.id).where(doca_ativa)).all()
+        _ocupacao_das_docas['docas'] = {doca.strip(): veiculo_id for doca, veiculo_id in linhas}
+        _ocupacao_das_docas['carregado_em'] = time.monotonic()
+    return _ocupacao_das_docas['docas']
+
+
+def _sincronizar_docas(tipo, dados):
+    with _trava_das_docas:
+        docas = _ocupacao_das_docas['docas']
+        if docas is None:
+            return
+        if tipo == 'veiculo_removido':
+            alterados, removidos = [], {dados['veiculo_id']}
+        elif tipo in ('veiculo', 'veiculos'):
+            alterados = [dados['veiculo']] if tipo == 'veiculo' else dados['veiculos']
+            removidos = {veiculo['id'] for veiculo in alterados}
+        else:
+            # Alterações em lote sem os veículos (arquivamento): recarregar na próxima consulta.
+            _ocupacao_das_docas['docas'] = None
+            return
+        for doca in [doca for doca, ocupante in docas.items() if ocupante in removidos]:
+            del docas[doca]
+        for veiculo in alterados:
+            doca = (veiculo['doca'] or '').strip()
+            if doca and veiculo['status'] in STATUS_NA_DOCA:
+                docas[doca] = veiculo['id']
+
+
+def _reservar_doca(doca, veiculo_id=None):
+    """
+    Reserva `doca` para o veículo `veiculo_id` (None num cadastro novo), se estiver livre.
+    Devolve (reserva, None), a liberar com _liberar_doca depois do commit ou do rollback, ou
+    (None, id do veículo que ocupa a doca), com id None quando a doca está reservada por outro cadastro.
+    """
+    with _trava_das_docas:
+        ocupante = _docas_em_memoria().get(doca)
+        if ocupante is not None and ocupante != veiculo_id:
+            return None, ocupante
+        reservada = _ocupacao_das_docas['reservas'].get(doca)
+        if reservada is not None and (veiculo_id is None or reservada[1] != veiculo_id):
+            return None, None
+        reserva = (object(), veiculo_id)
+        _ocupacao_das_docas['reservas'][doca] = reserva
+        return reserva, None
+
+
+def _liberar_doca(doca, reserva):
+    with _trava_das_docas:
+        if _ocupacao_das_docas['reservas'].get(doca) is reserva:
+            del _ocupacao_das_docas['reservas'][doca]
+
+
+def _doca_ocupada(doca, ocupante):
+    veiculo = db.session.get(Veiculo, ocupante) if ocupante is not None else None
+    if veiculo is None:
+        return f'ERRO: A doca {doca} está sendo ocupada por outro cadastro.'
+    return f'ERRO: A doca {doca} já está ocupada pelo veículo de placa {veiculo.placa}.'
+
+
+def _doca_tomada_no_commit(doca):
+    # O mapa deste processo estava desatualizado: recarregá-lo para citar o ocupante.
+    with _trava_das_docas:
+        _ocupacao_das_docas['docas'] = None
+        ocupante = _docas_em_memoria().get(doca)
+    return _doca_ocupada(doca, ocupante)
+
+
+def _conflito_de_doca(erro):
+    # SQLite não cita o nome do índice na mensagem, só a coluna.
+    mensagem = str(erro.orig)
+    return indice_doca_ativa.name in mensagem or f'{Veiculo.__tablename__}.doca' in mensagem
+
+
+def _doca_livre_mais_proxima(perto=None):
+    """
+    Doca livre mais próxima de `perto` (a menor livre se None), ou None se todas estiverem ocupadas.
+    """
+    with _trava_das_docas:
+        ocupadas = set(_docas_em_memoria()) | set(_ocupacao_das_docas['reservas'])
+    livres = [doca for doca in DOCAS if str(doca) not in ocupadas]
+    if not livres:
+        return None
+    if perto is None:
+        return livres[0]
+    return min(livres, key=lambda doca: (abs(doca - perto), doca))
+
+
+# --- DIÁRIO DE ALTERAÇÕES (SINCRONIZAÇÃO INCREMENTAL) ---
+DIAS_NO_DIARIO = 2
+
+
+class AlteracaoQuadro(db.Model):
+    """
+    Diário de alterações do quadro, gravado na mesma transação de cada alteração.
+    O id é a versão do quadro usada por /api/board?since= e pelos eventos; sai na ordem dos commits (TravaDiarioQuadro).
+    """
+    __tablename__ = 'alteracao_quadro'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    veiculo_id = db.Column(db.Integer, nullable=False, index=True)
+    tipo = db.Column(db.String(20), nullable=False)  # 'alterado', 'removido' ou 'arquivado'
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+
+class TravaDiarioQuadro(db.Model):
+    """
+    Linha única travada por toda transação que grava no diário, antes da primeira entrada, até o commit.
+    As transações gravam no diário uma de cada vez e os ids saem na ordem dos commits: sem a trava, no
+    PostgreSQL, o id N+1 podia ser confirmado antes do N, e quem já tinha lido até N+1 (leitor do diário,
+    /api/board?since=) nunca veria o N.
+    """
+    __tablename__ = 'trava_diario_quadro'
+    id = db.Column(db.Integer, primary_key=True)
+    transacoes = db.Column(db.Integer, nullable=False, default=0)
+
+
+def _travar_diario():
+    # Uma vez por transação: a trava vale até o commit ou o rollback.
+    sessao = db.session()
+    transacao = sessao.get_transaction()
+    if transacao is not None and sessao.info.get('diario_travado_em') is transacao:
+        return
+    _incrementar(TravaDiarioQuadro, {'id': 1}, {'transacoes': 1}, criar=True)
+    sessao.info['diario_travado_em'] = sessao.get_transaction()
+
+
+def _registrar_alteracao(veiculo_id, tipo):
+    _travar_diario()
+    db.session.add(AlteracaoQuadro(veiculo_id=veiculo_id, tipo=tipo))
+
+
+def _podar_diario(agora):
+    # A entrada mais recente nunca é apagada, para que os ids (versões) continuem crescendo em qualquer banco.
+    ultima = db.session.query(func.max(AlteracaoQuadro.id)).scalar()
+    if ultima is None:
+        return
+    AlteracaoQuadro.query.filter(
+        AlteracaoQuadro.criado_em < agora - timedelta(days=DIAS_NO_DIARIO), AlteracaoQuadro.id < ultima
+    ).delete(synchronize_session=False)
+
+
+# --- BUSCA POR TRECHO DE PLACA E MOTORISTA (ÍNDICE DE TRIGRAMAS) ---
+# Um filtro '%trecho%' não usa índice B-tree; com os trigramas normalizados de cada placa e motorista,
+# a busca vira consultas pela chave (campo, trigrama) e só os candidatos são conferidos com LIKE.
+CAMPOS_DE_BUSCA = ('placa', 'motorista')
+LINHAS_POR_LOTE_DE_INDEXACAO = 1000
+
+
+class TrigramaVeiculo(db.Model):
+    __tablename__ = 'trigrama_veiculo'
+    campo = db.Column(db.String(10), primary_key=True)
+    trigrama = db.Column(db.String(3), primary_key=True)
+    fonte = db.Column(db.String(10), primary_key=True)  # 'ativo' (Veiculo) ou 'historico' (VeiculoHistorico)
+    veiculo_id = db.Column(db.Integer, primary_key=True)
+
+
+def _normalizar_busca(campo, valor):
+    valor = (valor or '').strip()
+    if campo == 'placa':
+        # Mesma normalização da validação em adicionar_veiculo: maiúsculas e sem hífen.
+        return valor.upper().replace('-', '').replace(' ', '')
+    return ' '.join(valor.lower().split())
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _linhas_de_trigramas(veiculo, fonte):
+    return [
+        {'campo': campo, 'trigrama': trigrama, 'fonte': fonte, 'veiculo_id': veiculo.id}
+        for campo in CAMPOS_DE_BUSCA
+        for trigrama in _trigramas(_normalizar_busca(campo, getattr(veiculo, campo)))
+    ]
+
+
+def _desindexar_busca(veiculo_ids, fonte):
+    if veiculo_ids:
+        TrigramaVeiculo.query.filter(
+            TrigramaVeiculo.fonte == fonte, TrigramaVeiculo.veiculo_id.in_(veiculo_ids)
+        ).delete(synchronize_session=False)
+
+
+def _indexar_busca(veiculos, fonte):
+    """
+    (Re)indexa `veiculos` (já com id) na sessão atual; vai para o banco no mesmo commit da alteração.
+    """
+    _desindexar_busca([veiculo.id for veiculo in veiculos], fonte)
+    linhas = [linha for veiculo in veiculos for linha in _linhas_de_trigramas(veiculo, fonte)]
+    if linhas:
+        db.session.execute(insert(TrigramaVeiculo), linhas)
+
+
+def _condicao_de_busca(modelo, campo, trecho):
+    fonte = 'ativo' if modelo is Veiculo else 'historico'
+    trecho = _normalizar_busca(campo, trecho)
+    coluna = getattr(modelo, campo)
+    if campo == 'placa':
+        conferencia = func.replace(func.upper(coluna), '-', '').like(f'%{trecho}%')
+    else:
+        conferencia = coluna.ilike(f'%{trecho}%')
+    trigramas = _trigramas(trecho)
+    if not trigramas:
+        # Trechos com menos de 3 caracteres não têm trigrama: só a conferência direta.
+        return conferencia
+    candidatos = (
+        select(TrigramaVeiculo.veiculo_id)
+        .where(TrigramaVeiculo.campo == campo, TrigramaVeiculo.fonte == fonte, TrigramaVeiculo.trigrama.in_(trigramas))
+        .group_by(TrigramaVeiculo.veiculo_id)
+        .having(func.count() == len(trigramas))
+    )
+    return and_(modelo.id.in_(candidatos), conferencia)
+
+
+def _preencher_indice_de_busca():
+    for modelo, fonte in ((Veiculo, 'ativo'), (VeiculoHistorico, 'historico')):
+        consulta = db.session.execute(
+            select(modelo).execution_options(yield_per=LINHAS_POR_LOTE_DE_INDEXACAO)
+        ).scalars()
+        for lote in consulta.partitions():
+            linhas = [linha for veiculo in lote for linha in _linhas_de_trigramas(veiculo, fonte)]
+            if linhas:
+                db.session.execute(insert(TrigramaVeiculo), linhas)
+    db.session.commit()
+
+
+# --- RESUMO DE DESCARGA POR TURNO ---
+# Um veículo entra no resumo do seu turno de finalização ao ser finalizado e sai dele se for reaberto.
+# Ao ser arquivado continua contado (já estava), então os resumos cobrem ativos e histórico sem reler nenhum dos dois.
+# Os totais e as faixas do histograma são somados no banco (UPDATE ... SET coluna = coluna + delta), nunca
+# lidos e regravados: finalizações simultâneas no mesmo resumo não perdem contagens.
+CAMPOS_DO_RESUMO = ('dia_turno', 'turno', 'doca', 'origem', 'tipo_veiculo')
+AGRUPAMENTOS_DO_RESUMO = ('doca', 'origem', 'tipo_veiculo', 'turno')
+COLUNAS_SOMADAS_DO_RESUMO = ('quantidade', 'quantidade_com_tempo', 'soma_segundos_descarga', 'soma_percent_ocupacao')
+SEGUNDOS_POR_FAIXA_DO_HISTOGRAMA = 300
+DIAS_PADRAO_DA_ANALISE = 7
+
+
+class ResumoTurnoDescarga(db.Model):
+    """
+    Totais de descarga de um turno (dia de início + turno de finalização) por doca, origem e tipo de veículo.
+    O histograma fica em FaixaResumoDescarga, para calcular percentis sem reler os veículos.
+    """
+    __tablename__ = 'resumo_turno_descarga'
+    __table_args__ = (db.UniqueConstraint(*CAMPOS_DO_RESUMO, name='uq_resumo_turno_descarga'),)
+    id = db.Column(db.Integer, primary_key=True)
+    dia_turno = db.Column(db.Date, nullable=False, index=True)
+    turno = db.Column(db.String(5), nullable=False)
+    doca = db.Column(db.String(10), nullable=False)
+    origem = db.Column(db.String(100), nullable=False)
+    tipo_veiculo = db.Column(db.String(50), nullable=False)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    quantidade_com_tempo = db.Column(db.Integer, nullable=False, default=0)
+    soma_segundos_descarga = db.Column(db.Integer, nullable=False, default=0)
+    soma_percent_ocupacao = db.Column(db.Integer, nullable=False, default=0)
+
+
+class FaixaResumoDescarga(db.Model):
+    """
+    Quantidade de descargas de um resumo na faixa de 5 minutos `faixa` (duração // SEGUNDOS_POR_FAIXA_DO_HISTOGRAMA).
+    """
+    __tablename__ = 'faixa_resumo_descarga'
+    resumo_id = db.Column(db.Integer, db.ForeignKey('resumo_turno_descarga.id'), primary_key=True)
+    faixa = db.Column(db.Integer, primary_key=True)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+
+
+def _contribuicao_no_resumo(veiculo):
+    """
+    (chave do resumo, segundos de descarga ou None, % de ocupação) de um veículo finalizado; None se não finalizado.
+    """
+    if not veiculo.horario_atualizacao or not veiculo.turno_finalizacao:
+        return None
+    inicio_do_turno, _ = get_shift_boundaries(veiculo.horario_atualizacao, veiculo.turno_finalizacao)
+    chave = (
+        (inicio_do_turno or veiculo.horario_atualizacao).date(), veiculo.turno_finalizacao,
+        veiculo.doca or '', veiculo.origem or '', veiculo.tipo_veiculo or ''
+    )
+    segundos = None
+    if veiculo.hora_inicio:
+        segundos = max(int((veiculo.horario_atualizacao - veiculo.hora_inicio).total_seconds()), 0)
+    return chave, segundos, veiculo.percent_ocupacao or 0
+
+
+def _incrementos_do_resumo(contribuicao, sinal):
+    """
+    ({coluna do resumo: delta}, faixa do histograma ou None) da contribuição de um veículo.
+    """
+    _, segundos, ocupacao = contribuicao
+    incrementos = {'quantidade': sinal, 'soma_percent_ocupacao': sinal * ocupacao}
+    if segundos is None:
+        return incrementos, None
+    incrementos.update(quantidade_com_tempo=sinal, soma_segundos_descarga=sinal * segundos)
+    return incrementos, segundos // SEGUNDOS_POR_FAIXA_DO_HISTOGRAMA
+
+
+def _incrementar(modelo, chave, incrementos, criar):
+    """
+    Soma os `incrementos` na linha de `chave` sem lê-la; se ela não existe e `criar`, insere-a com eles.
+    Quando outra transação insere a mesma linha antes, o INSERT falha na chave única dentro do savepoint e
+    o UPDATE é repetido sobre a linha dela. Devolve False se a linha não existe e não foi criada.
+    """
+    filtro = [getattr(modelo, campo) == valor for campo, valor in chave.items()]
+    somar = update(modelo).where(*filtro).values(
+        {coluna: getattr(modelo, coluna) + delta for coluna, delta in incrementos.items()}
+    ).execution_options(synchronize_session=False)
+    if db.session.execute(somar).rowcount:
+        return True
+    if not criar:
+        return False
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(modelo).values(**chave, **incrementos))
+    except IntegrityError:
+        db.session.execute(somar)
+    return True
+
+
+def _atualizar_resumo(contribuicao, sinal):
+    """
+    Soma (sinal=1) ou retira (sinal=-1) a contribuição de um veículo do resumo do seu turno, na sessão atual.
+    """
+    if contribuicao is None:
+        return
+    chave = dict(zip(CAMPOS_DO_RESUMO, contribuicao[0]))
+    incrementos, faixa = _incrementos_do_resumo(contribuicao, sinal)
+    if not _incrementar(ResumoTurnoDescarga, chave, incrementos, criar=sinal > 0) or faixa is None:
+        return
+    resumo_id = db.session.execute(select(ResumoTurnoDescarga.id).filter_by(**chave)).scalar_one()
+    _incrementar(FaixaResumoDescarga, {'resumo_id': resumo_id, 'faixa': faixa}, {'quantidade': sinal}, criar=sinal > 0)
+
+
+def _percentil_do_histograma(histograma, percentil):
+    total = sum(histograma.values())
+    if not total:
+        return None
+    alvo = math.ceil(total * percentil)
+    acumulado = 0
+    for faixa in sorted(histograma):
+        acumulado += histograma[faixa]
+        if acumulado >= alvo:
+            return (faixa + 1) * SEGUNDOS_POR_FAIXA_DO_HISTOGRAMA
+    return None
+
+
+def _preencher_resumo_de_descarga():
+    resumos, faixas = {}, {}
+    for modelo, finalizado in ((VeiculoHistorico, VeiculoHistorico.status_final == 'FINALIZADO'), (Veiculo, Veiculo.status == 'FINALIZADO')):
+        consulta = db.session.execute(
+            select(modelo).where(finalizado).execution_options(yield_per=LINHAS_POR_LOTE_DE_INDEXACAO)
+        ).scalars()
+        for lote in consulta.partitions():
+            for veiculo in lote:
+                contribuicao = _contribuicao_no_resumo(veiculo)
+                if contribuicao is None:
+                    continue
+                incrementos, faixa = _incrementos_do_resumo(contribuicao, 1)
+                totais = resumos.setdefault(contribuicao[0], dict.fromkeys(COLUNAS_SOMADAS_DO_RESUMO, 0))
+                for coluna, delta in incrementos.items():
+                    totais[coluna] += delta
+                if faixa is not None:
+                    faixas[contribuicao[0], faixa] = faixas.get((contribuicao[0], faixa), 0) + 1
+    if resumos:
+        db.session.execute(insert(ResumoTurnoDescarga), [
+            dict(zip(CAMPOS_DO_RESUMO, chave), **totais) for chave, totais in resumos.items()
+        ])
+        ids = {
+            tuple(linha[1:]): linha[0]
+            for linha in db.session.execute(select(ResumoTurnoDescarga.id, *[getattr(ResumoTurnoDescarga, campo) for campo in CAMPOS_DO_RESUMO]))
+        }
+        if faixas:
+            db.session.execute(insert(FaixaResumoDescarga), [
+                {'resumo_id': ids[chave], 'faixa': faixa, 'quantidade': quantidade} for (chave, faixa), quantidade in faixas.items()
+            ])
+    db.session.commit()
+
+
+# --- ARQUIVAMENTO DOS TURNOS ANTERIORES ---
+SEGUNDOS_APOS_FIM_DO_TURNO = 60
+
+
+def arquivar_turnos_anteriores(agora=None):
+    """
+    Move para o histórico, numa única transação, os veículos finalizados em turnos anteriores:
+    um INSERT ... SELECT, um DELETE em lote e a manutenção do diário e do índice de busca.
+    Devolve os ids arquivados (vazio se não havia nada a arquivar).
+    """
+    agora = agora or datetime.now()
+    turno_atual = get_shift_name_from_hour(agora.hour)
+    do_turno_anterior = and_(
+        Veiculo.status == 'FINALIZADO',
+        or_(Veiculo.turno_finalizacao != turno_atual, Veiculo.turno_finalizacao.is_(None))
+    )
+    # FOR UPDATE: no PostgreSQL/MySQL uma execução concorrente (outro processo ou o botão de arquivar) espera o
+    # commit desta e, relida a condição, não encontra mais as linhas. No SQLite o FOR UPDATE não é gerado; lá a
+    # exclusão vem da trava do diário, que escreve e portanto toma a trava do banco inteiro: os ids são relidos
+    # depois dela, quando uma execução anterior já terminou. A ordem (veículos, depois diário) é a mesma das rotas.
+    ids_arquivados = db.session.execute(select(Veiculo.id).where(do_turno_anterior).with_for_update()).scalars().all()
+    if not ids_arquivados:
+        return []
+    _travar_diario()
+    ids_arquivados = db.session.execute(
+        select(Veiculo.id).where(do_turno_anterior, Veiculo.id.in_(ids_arquivados))
+    ).scalars().all()
+    if not ids_arquivados:
+        db.session.rollback()
+        return []
+
+    colunas = [coluna for coluna in COLUNAS_DA_LISTAGEM if coluna != 'id']
+    do_turno_anterior = Veiculo.id.in_(ids_arquivados)
+    copia = insert(VeiculoHistorico).from_select(
+        colunas + ['status_final', 'data_arquivamento'],
+        select(*[getattr(Veiculo, coluna) for coluna in colunas], literal('FINALIZADO'), literal(agora)).where(do_turno_anterior)
+    )
+    colunas_indexadas = (VeiculoHistorico.id, VeiculoHistorico.placa, VeiculoHistorico.motorista)
+    if db.session.get_bind().dialect.insert_returning:
+        arquivados = db.session.execute(copia.returning(*colunas_indexadas)).all()
+    else:
+        # Sem RETURNING (MySQL): as linhas copiadas são as de id acima do maior id anterior à cópia; com a trava
+        # do diário nenhuma outra cópia corre junto. Comparar data_arquivamento com `agora` falharia onde o banco
+        # trunca ou arredonda as frações de segundo.
+        ultimo_id = db.session.query(func.max(VeiculoHistorico.id)).scalar() or 0
+        db.session.execute(copia)
+        arquivados = db.session.execute(select(*colunas_indexadas).where(VeiculoHistorico.id > ultimo_id)).all()
+    db.session.execute(insert(AlteracaoQuadro).from_select(
+        ['veiculo_id', 'tipo', 'criado_em'],
+        select(Veiculo.id, literal('arquivado'), literal(agora)).where(do_turno_anterior)
+    ))
+    _desindexar_busca(ids_arquivados, 'ativo')
+    _indexar_busca(arquivados, 'historico')
+    Veiculo.query.filter(do_turno_anterior).delete(synchronize_session=False)
+    _podar_diario(agora)
+    db.session.commit()
+    _quadro_alterado('veiculos_arquivados', {'veiculo_ids': ids_arquivados})
+    return ids_arquivados
+
+
+def _arquivar_nos_fins_de_turno(app):
+    # Cada processo do servidor roda o seu agendador; as travas de arquivar_turnos_anteriores (FOR UPDATE e a
+    # trava do diário) fazem o segundo esperar o primeiro e não encontrar nada.
+    while True:
+        agora = datetime.now()
+        _, fim_do_turno = get_shift_boundaries(agora, get_shift_name_from_hour(agora.hour))
+        proximo = (fim_do_turno or agora + timedelta(hours=1)) + timedelta(seconds=SEGUNDOS_APOS_FIM_DO_TURNO)
+        time.sleep(max((proximo - datetime.now()).total_seconds(), 1))
+        with app.app_context():
+            try:
+                ids_arquivados = arquivar_turnos_anteriores()
+                app.logger.info('Arquivamento automático: %d veículo(s) arquivados.', len(ids_arquivados))
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Falha no arquivamento automático do fim de turno.')
+
+
+def preparar_banco_do_quadro(app):
+    """
+    Migração do quadro num banco que já tem as tabelas de veículos: índices, a coluna tempo_descarga_segundos
+    e as tabelas auxiliares, com o preenchimento do índice de busca e dos resumos de descarga.
+    Roda uma vez a cada atualização, antes de subir os workers (`flask kanban preparar-banco`), e não no boot
+    de cada processo: dois workers migrando juntos fariam o mesmo ALTER TABLE e os mesmos preenchimentos.
+    Pode ser repetida, o que já existe é mantido. Devolve False se as tabelas de veículos ainda não existem.
+    """
+    # create_all não cria índices em tabelas que já existem. O índice de expressão não aparece na reflexão
+    # do SQLite (checkfirst não o enxerga), por isso IF NOT EXISTS.
+    with app.app_context():
+        inspetor = inspect(db.engine)
+        if not all(inspetor.has_table(modelo.__tablename__) for modelo in (Veiculo, VeiculoHistorico)):
+            return False
+        with db.engine.begin() as conexao:
+            conexao.execute(CreateIndex(indice_quadro, if_not_exists=True))
+        _migrar_tempo_descarga_segundos()
+        try:
+            with db.engine.begin() as conexao:
+                conexao.execute(CreateIndex(indice_doca_ativa, if_not_exists=True))
+        except IntegrityError:
+            app.logger.warning(
+                'Índice %s não criado: há docas ocupadas por mais de um veículo ativo.', indice_doca_ativa.name
+            )
+        AlteracaoQuadro.__table__.create(db.engine, checkfirst=True)
+        TravaDiarioQuadro.__table__.create(db.engine, checkfirst=True)
+        TrigramaVeiculo.__table__.create(db.engine, checkfirst=True)
+        # Os preenchimentos são decididos pelo conteúdo e não pela existência das tabelas: o create_all pode
+        # tê-las criado vazias.
+        if _tabela_vazia(TrigramaVeiculo):
+            _preencher_indice_de_busca()
+        ResumoTurnoDescarga.__table__.create(db.engine, checkfirst=True)
+        FaixaResumoDescarga.__table__.create(db.engine, checkfirst=True)
+        if _tabela_vazia(ResumoTurnoDescarga):
+            _preencher_resumo_de_descarga()
+    return True
+
+
+def _tabela_vazia(modelo):
+    return db.session.execute(select(literal(1)).select_from(modelo).limit(1)).first() is None
+
+
+@kanban_bp.cli.command('preparar-banco')
+def preparar_banco_command():
+    """Migra o banco para esta versão do quadro (rodar antes de subir os workers)."""
+    if preparar_banco_do_quadro(current_app):
+        click.echo('Banco do quadro preparado.')
+    else:
+        raise click.ClickException('As tabelas de veículos ainda não existem: crie-as (create_all) e rode de novo.')
+
+
+def _iniciar_arquivamento_automatico(state):
+    if state.app.config.get('KANBAN_ARQUIVAMENTO_AUTOMATICO'):
+        threading.Thread(target=_arquivar_nos_fins_de_turno, args=(state.app,), name='arquivamento-kanban', daemon=True).start()
+
+
+kanban_bp.record_once(_iniciar_arquivamento_automatico)
+
  
- @kanban_bp.route('/')
+@kanban_bp.route('/')
 @login_required()
 def portal():
     return render_template('portal.html')
@@ -22,69 +872,14 @@ def kanban():
     """
     Rota para exibir o Kanban de Veículos com nova ordenação.
     """
-      status_order = case(
-        (Veiculo.status == 'AGUARDANDO', 1),
-        (Veiculo.status == 'EM_PROCESSO', 2),
-        (Veiculo.status == 'FINALIZADO', 3),
-        else_=4
-    )
+    linhas = db.session.query(Veiculo, classe_finalizacao).order_by(*ORDEM_DO_QUADRO).all()
+    kanban_counts, processo_contadores = _contadores_do_quadro(datetime.now())
 
-     veiculos = Veiculo.query.order_by(
-        status_order,  # 1. Agrupa por status
-        Veiculo.data.asc(), # 2. Ordena por data de criação (mais antigo primeiro) para 'Aguardando'
-        Veiculo.hora_inicio.asc(), # 3. Ordena por hora de início para 'Em Processo'
-        desc(Veiculo.horario_atualizacao) # 4. Ordena por finalização (mais novo primeiro) para 'Finalizado'
-    ).all()
- 
-
-      aguardando_count = 0
-    em_processo_count = 0
-    finalizados_count = 0
-    processo_ok = 0
-    processo_alerta = 0
-    processo_atrasado = 0
-
-    for veiculo in veiculos:
-        if veiculo.status == 'AGUARDANDO':
-            aguardando_count += 1
-        elif veiculo.status == 'FINALIZADO':
-            finalizados_count += 1
-        elif veiculo.status == 'EM_PROCESSO':
-            em_processo_count += 1
-            if veiculo.hora_inicio:
-                duracao = datetime.now() - veiculo.hora_inicio
-                horas_em_processo = duracao.total_seconds() / 3600
-                if horas_em_processo < 2:
-                    processo_ok += 1
-                elif 2 <= horas_em_processo < 4:
-                    processo_alerta += 1
-                else:
-                    processo_atrasado += 1
-
-    kanban_counts = {
-        'aguardando': aguardando_count,
-        'em_processo': em_processo_count,
-        'finalizado': finalizados_count
-    }
-    processo_contadores = {
-        'ok': processo_ok,
-        'alerta': processo_alerta,
-        'atrasado': processo_atrasado
-    }
-
-    for veiculo in veiculos:
+    veiculos = []
+    for veiculo, classe in linhas:
         veiculo.hora_inicio_iso = veiculo.hora_inicio.isoformat() if veiculo.hora_inicio else None
-        veiculo.finalization_status_class = 'status-ok'
-        if veiculo.status == 'FINALIZADO' and veiculo.tempo_descarga:
-            try:
-                horas_str = veiculo.tempo_descarga.split('h')[0].strip()
-                total_hours = float(horas_str)
-                if total_hours >= 4:
-                    veiculo.finalization_status_class = 'status-atrasado'
-                elif total_hours >= 2:
-                    veiculo.finalization_status_class = 'status-alerta'
-            except (ValueError, IndexError) as e:
-                print(f"Erro ao processar tempo de descarga para cor: {e}")
+        veiculo.finalization_status_class = classe
+        veiculos.append(veiculo)
 
     return render_template('index.html', 
                            veiculos=veiculos, 
@@ -93,99 +888,226 @@ def kanban():
 
  
  
+CAMPOS_OBRIGATORIOS_DO_VEICULO = ['placa', 'origem', 'turno', 'id_viagem', 'data_planejada', 'data_checkin', 'hora_real_chegada', 'volumetria_sistematica', 'percent_ocupacao', 'rede_contencao', 'doca']
+
+
+def _validar_dados_veiculo(dados):
+    """
+    Valida os dados de cadastro de um veículo (formulário ou linha de manifesto).
+    Devolve (valores para Veiculo(...), None) ou (None, mensagem de erro).
+    """
+    tipo_veiculo_selecionado = dados.get('tipo_veiculo')
+    veiculo_final = ''
+    if tipo_veiculo_selecionado == 'Outro':
+        veiculo_final = (dados.get('tipo_veiculo_outro') or '').strip()
+        if not veiculo_final:
+            return None, 'ERRO: Se "Outro" for selecionado para Veículo, você deve especificar o tipo.'
+    elif tipo_veiculo_selecionado in ['Toco', 'Carreta', 'Vuc', 'Truck']:
+        veiculo_final = tipo_veiculo_selecionado
+    else:
+        return None, 'ERRO: Por favor, selecione um tipo de veículo válido.'
+
+    tipo_carga_selecionado = dados.get('tipo_carga')
+    carga_final = ''
+    if tipo_carga_selecionado == 'Outra':
+        carga_final = (dados.get('tipo_carga_outra') or '').strip()
+        if not carga_final:
+            return None, 'ERRO: Se "Outra" for selecionado para Carga, você deve especificar o tipo.'
+    elif tipo_carga_selecionado in ['Saca', 'Batida', 'Saca/Batida']:
+        carga_final = tipo_carga_selecionado
+    else:
+        return None, 'ERRO: Por favor, selecione um tipo de carga válido.'
+
+    for campo in CAMPOS_OBRIGATORIOS_DO_VEICULO:
+        if not dados.get(campo):
+            return None, f'ERRO: O campo "{campo.replace("_", " ").title()}" é obrigatório.'
+
+    placa = dados.get('placa', '').upper().strip()
+    placa_pattern = re.compile(r'^[A-Z]{3}\d[A-Z\d]\d{2}$')
+    if not placa_pattern.match(placa.replace('-', '')):
+        return None, 'ERRO: Formato de placa inválido.'
+
+    try:
+        volumetria = int(dados.get('volumetria_sistematica'))
+        ocupacao = int(dados.get('percent_ocupacao'))
+        if not (0 <= ocupacao <= 100):
+            raise ValueError("Percentual de ocupação fora do intervalo.")
+    except (ValueError, TypeError):
+        return None, 'ERRO: Volumetria e % de Ocupação devem ser números inteiros (Ocupação de 0-100).'
+
+    return {
+        'placa': placa,
+        'origem': dados.get('origem'),
+        'turno': dados.get('turno'),
+        'id_viagem': dados.get('id_viagem'),
+        'data_planejada': dados.get('data_planejada'),
+        'data_checkin': dados.get('data_checkin'),
+        'hora_real_chegada': dados.get('hora_real_chegada'),
+        'tipo_veiculo': veiculo_final,
+        'tipo_carga': carga_final,  # USA O VALOR FINAL VALIDADO
+        'volumetria_sistematica': volumetria,
+        'percent_ocupacao': ocupacao,
+        'rede_contencao': dados.get('rede_contencao'),
+        'doca': dados.get('doca').strip(),
+        'observacao': dados.get('observacao'),
+    }, None
+
+
 @kanban_bp.route('/adicionar_veiculo', methods=['GET', 'POST'])
 @login_required(roles=['ADMIN', 'T1', 'T2', 'T3'])
 def adicionar_veiculo():
     if request.method == 'POST':
         form_data = request.form.to_dict()
 
-         tipo_veiculo_selecionado = form_data.get('tipo_veiculo')
-        veiculo_final = ''
-        if tipo_veiculo_selecionado == 'Outro':
-            veiculo_final = form_data.get('tipo_veiculo_outro', '').strip()
-            if not veiculo_final:
-                flash('ERRO: Se "Outro" for selecionado para Veículo, você deve especificar o tipo.', 'error')
-                return render_template('adicionar_veiculo.html', form_data=form_data)
-        elif tipo_veiculo_selecionado in ['Toco', 'Carreta', 'Vuc', 'Truck']:
-            veiculo_final = tipo_veiculo_selecionado
-        else:
-            flash('ERRO: Por favor, selecione um tipo de veículo válido.', 'error')
+        valores, erro = _validar_dados_veiculo(form_data)
+        if erro:
+            flash(erro, 'error')
             return render_template('adicionar_veiculo.html', form_data=form_data)
+        placa, doca = valores['placa'], valores['doca']
 
-         tipo_carga_selecionado = form_data.get('tipo_carga')
-        carga_final = ''
-        if tipo_carga_selecionado == 'Outra':
-            carga_final = form_data.get('tipo_carga_outra', '').strip()
-            if not carga_final:
-                flash('ERRO: Se "Outra" for selecionado para Carga, você deve especificar o tipo.', 'error')
-                return render_template('adicionar_veiculo.html', form_data=form_data)
-        elif tipo_carga_selecionado in ['Saca', 'Batida', 'Saca/Batida']:
-            carga_final = tipo_carga_selecionado
-        else:
-            flash('ERRO: Por favor, selecione um tipo de carga válido.', 'error')
+        reserva, ocupante = _reservar_doca(doca)
+        if reserva is None:
+            flash(_doca_ocupada(doca, ocupante), 'error')
             return render_template('adicionar_veiculo.html', form_data=form_data)
- 
-        campos_obrigatorios = ['placa', 'origem', 'turno', 'id_viagem', 'data_planejada', 'data_checkin', 'hora_real_chegada', 'volumetria_sistematica', 'percent_ocupacao', 'rede_contencao', 'doca']
-        for campo in campos_obrigatorios:
-            if not form_data.get(campo):
-                flash(f'ERRO: O campo "{campo.replace("_", " ").title()}" é obrigatório.', 'error')
-                return render_template('adicionar_veiculo.html', form_data=form_data)
-
-        placa = form_data.get('placa', '').upper().strip()
-         placa_pattern = re.compile(r'^[A-Z]{3}\d[A-Z\d]\d{2}$')
-        if not placa_pattern.match(placa.replace('-', '')):
-            flash('ERRO: Formato de placa inválido.', 'error')
-            return render_template('adicionar_veiculo.html', form_data=form_data)
-
-         try:
-            volumetria = int(form_data.get('volumetria_sistematica'))
-            ocupacao = int(form_data.get('percent_ocupacao'))
-            if not (0 <= ocupacao <= 100):
-                raise ValueError("Percentual de ocupação fora do intervalo.")
-        except (ValueError, TypeError):
-            flash('ERRO: Volumetria e % de Ocupação devem ser números inteiros (Ocupação de 0-100).', 'error')
-            return render_template('adicionar_veiculo.html', form_data=form_data)
-            
-        doca = form_data.get('doca')
-        if doca:
-            veiculo_existente = Veiculo.query.filter(Veiculo.doca == doca, Veiculo.status.in_(['AGUARDANDO', 'EM_PROCESSO'])).first()
-            if veiculo_existente:
-                flash(f'ERRO: A doca {doca} já está ocupada pelo veículo de placa {veiculo_existente.placa}.', 'error')
-                return render_template('adicionar_veiculo.html', form_data=form_data)
 
         try:
-            novo_veiculo = Veiculo(
-                placa=placa,
-                origem=form_data.get('origem'),
-                turno=form_data.get('turno'),
-                id_viagem=form_data.get('id_viagem'),
-                data_planejada=form_data.get('data_planejada'),
-                data_checkin=form_data.get('data_checkin'),
-                hora_real_chegada=form_data.get('hora_real_chegada'),
-                tipo_veiculo=veiculo_final,
-                tipo_carga=carga_final,  # USA O VALOR FINAL VALIDADO
-                volumetria_sistematica=volumetria,
-                percent_ocupacao=ocupacao,
-                rede_contencao=form_data.get('rede_contencao'),
-                doca=doca,
-                observacao=form_data.get('observacao'),
-                status='AGUARDANDO'
-            )
+            novo_veiculo = Veiculo(**valores, status='AGUARDANDO')
             db.session.add(novo_veiculo)
+            db.session.flush()
+            _indexar_busca([novo_veiculo], 'ativo')
+            _registrar_alteracao(novo_veiculo.id, 'alterado')
             log_action('CRIAR_VEICULO', f"Veículo placa '{placa}' foi adicionado.")
             db.session.commit()
+            _veiculo_alterado(novo_veiculo)
             
             flash(f'Veículo com placa {placa} adicionado com sucesso!', 'veiculo_adicionado')
             return redirect(url_for('kanban.kanban'))
+        except IntegrityError as e:
+            db.session.rollback()
+            flash(_doca_tomada_no_commit(doca) if _conflito_de_doca(e) else f'Ocorreu um erro ao salvar no banco de dados: {e}', 'error')
+            return render_template('adicionar_veiculo.html', form_data=form_data)
         except Exception as e:
             db.session.rollback()
             flash(f'Ocorreu um erro ao salvar no banco de dados: {e}', 'error')
             return render_template('adicionar_veiculo.html', form_data=form_data)
+        finally:
+            _liberar_doca(doca, reserva)
 
     return render_template('adicionar_veiculo.html', form_data={})
 
+
+# --- CHECK-IN EM LOTE (MANIFESTO CSV/XLSX) ---
+LINHAS_MAXIMAS_DO_MANIFESTO = 500
+
+
+def _valor_do_manifesto(valor):
+    # Células do XLSX chegam tipadas; o manifesto é validado como texto, igual ao formulário.
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d') if valor.time() == datetime.min.time() else valor.strftime('%Y-%m-%d %H:%M')
+    if hasattr(valor, 'strftime'):
+        return valor.strftime('%Y-%m-%d') if isinstance(valor, date) else valor.strftime('%H:%M')
+    return str(valor).strip()
+
+
+def _ler_manifesto(arquivo):
+    """
+    Linhas do manifesto como (número da linha no arquivo, {coluna: texto}), com os nomes das colunas do formulário de cadastro
+    no cabeçalho. Aceita CSV (separado por vírgula ou ponto e vírgula) e XLSX (primeira planilha).
+    """
+    nome = (arquivo.filename or '').lower()
+    if nome.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        planilha = load_workbook(arquivo.stream, read_only=True, data_only=True).worksheets[0]
+        linhas = planilha.iter_rows(values_only=True)
+    elif nome.endswith('.csv'):
+        texto = arquivo.stream.read().decode('utf-8-sig')
+        dialeto = csv.Sniffer().sniff(texto.split('\n', 1)[0], delimiters=',;')
+        linhas = csv.reader(io.StringIO(texto), dialeto)
+    else:
+        raise ValueError('formato não suportado, envie um arquivo .csv ou .xlsx.')
+    cabecalho = [_valor_do_manifesto(coluna).lower() for coluna in next(linhas, [])]
+    return [
+        (numero, dict(zip(cabecalho, map(_valor_do_manifesto, linha))))
+        for numero, linha in enumerate(linhas, start=2) if any(_valor_do_manifesto(valor) for valor in linha)
+    ]
+
+
+@kanban_bp.route('/api/veiculos/checkin_em_lote', methods=['POST'])
+@login_required(roles=['ADMIN', 'T1', 'T2', 'T3'])
+def checkin_em_lote():
+    """
+    Cadastra de uma vez os veículos de um manifesto de chegadas (arquivo no campo `manifesto`).
+    As linhas válidas entram numa única transação; as inválidas voltam em `erros` com o número da linha.
+    """
+    arquivo = request.files.get('manifesto')
+    if arquivo is None:
+        return jsonify({'success': False, 'message': 'Nenhum manifesto enviado.'}), 400
+    try:
+        linhas = _ler_manifesto(arquivo)
+    except ImportError:
+        return jsonify({'success': False, 'message': 'Leitura de XLSX indisponível: instale o openpyxl.'}), 400
+    except (ValueError, csv.Error, UnicodeDecodeError) as e:
+        return jsonify({'success': False, 'message': f'Manifesto inválido: {e}'}), 400
+    if len(linhas) > LINHAS_MAXIMAS_DO_MANIFESTO:
+        return jsonify({'success': False, 'message': f'O manifesto tem mais de {LINHAS_MAXIMAS_DO_MANIFESTO} linhas.'}), 400
+
+    erros, validos, reservas = [], [], {}
+    try:
+        for numero, dados in linhas:
+            valores, erro = _validar_dados_veiculo(dados)
+            if erro is None and valores['doca'] in reservas:
+                erro = f"ERRO: A doca {valores['doca']} está repetida no manifesto (linha {reservas[valores['doca']][0]})."
+            if erro is None:
+                reserva, ocupante = _reservar_doca(valores['doca'])
+                if reserva is None:
+                    erro = _doca_ocupada(valores['doca'], ocupante)
+                else:
+                    reservas[valores['doca']] = (numero, reserva)
+            if erro:
+                erros.append({'linha': numero, 'placa': dados.get('placa'), 'mensagem': erro})
+            else:
+                validos.append(Veiculo(**valores, status='AGUARDANDO'))
+
+        if validos:
+            try:
+                db.session.add_all(validos)
+                db.session.flush()
+                _indexar_busca(validos, 'ativo')
+                for veiculo in validos:
+                    _registrar_alteracao(veiculo.id, 'alterado')
+                log_action('CHECKIN_EM_LOTE', f"{len(validos)} veículo(s) adicionados pelo manifesto '{arquivo.filename}': {', '.join(v.placa for v in validos)}.")
+                db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                if not _conflito_de_doca(e):
+                    return jsonify({'success': False, 'message': f'Ocorreu um erro ao salvar no banco de dados: {e}'}), 500
+                with _trava_das_docas:
+                    _ocupacao_das_docas['docas'] = None
+                return jsonify({
+                    'success': False, 'erros': erros,
+                    'message': 'Uma das docas do manifesto foi ocupada por outro cadastro. Nenhum veículo foi adicionado; envie o manifesto novamente.'
+                }), 409
+            except Exception as e:
+                db.session.rollback()
+                return jsonify({'success': False, 'message': f'Ocorreu um erro ao salvar no banco de dados: {e}'}), 500
+            for veiculo in validos:
+                _veiculo_alterado(veiculo)
+    finally:
+        for doca, (_, reserva) in reservas.items():
+            _liberar_doca(doca, reserva)
+
+    return jsonify({
+        'success': not erros,
+        'adicionados': [_serializar_veiculo(veiculo) for veiculo in validos],
+        'erros': erros,
+    })
+
  
- @kanban_bp.route('/editar_veiculo/<int:veiculo_id>', methods=['GET', 'POST'])
+@kanban_bp.route('/editar_veiculo/<int:veiculo_id>', methods=['GET', 'POST'])
 @login_required(roles=['ADMIN', 'T1', 'T2', 'T3'])
 def editar_veiculo(veiculo_id):
     veiculo = Veiculo.query.get_or_404(veiculo_id)
@@ -193,7 +1115,7 @@ def editar_veiculo(veiculo_id):
         flash('Você não tem permissão para editar um veículo finalizado.', 'danger')
         return redirect(url_for('kanban.kanban'))
     if request.method == 'POST':
-         tipo_veiculo_selecionado = request.form.get('tipo_veiculo')
+        tipo_veiculo_selecionado = request.form.get('tipo_veiculo')
         veiculo_final = ''
         if tipo_veiculo_selecionado == 'Outro':
             veiculo_final = request.form.get('tipo_veiculo_outro', '').strip()
@@ -206,7 +1128,7 @@ def editar_veiculo(veiculo_id):
             flash('ERRO: Por favor, selecione um tipo de veículo válido.', 'error')
             return render_template('editar_veiculo.html', veiculo=veiculo)
 
-         tipo_carga_selecionado = request.form.get('tipo_carga')
+        tipo_carga_selecionado = request.form.get('tipo_carga')
         carga_final = ''
         if tipo_carga_selecionado == 'Outra':
             carga_final = request.form.get('tipo_carga_outra', '').strip()
@@ -220,18 +1142,21 @@ def editar_veiculo(veiculo_id):
             return render_template('editar_veiculo.html', veiculo=veiculo)
          
         placa = request.form.get('placa', '').upper().strip()
-         placa_pattern = re.compile(r'^[A-Z]{3}\d[A-Z\d]\d{2}$')
+        placa_pattern = re.compile(r'^[A-Z]{3}\d[A-Z\d]\d{2}$')
         if not placa_pattern.match(placa.replace('-', '')):
             flash('ERRO: Formato de placa inválido.', 'error')
             return render_template('editar_veiculo.html', veiculo=veiculo)
 
-        doca = request.form.get('doca')
-        if doca:
-            veiculo_existente = Veiculo.query.filter(Veiculo.doca == doca, Veiculo.status.in_(['AGUARDANDO', 'EM_PROCESSO']), Veiculo.id != veiculo_id).first()
-            if veiculo_existente:
-                flash(f'ERRO: A doca {doca} já está ocupada pelo veículo de placa {veiculo_existente.placa}.', 'error')
+        doca = (request.form.get('doca') or '').strip()
+        reserva = None
+        if doca and veiculo.status in STATUS_NA_DOCA:
+            reserva, ocupante = _reservar_doca(doca, veiculo.id)
+            if reserva is None:
+                flash(_doca_ocupada(doca, ocupante), 'error')
                 return render_template('editar_veiculo.html', veiculo=veiculo)
         try:
+            # Um finalizado editado (só ADMIN) pode mudar de doca, origem ou tipo: o resumo acompanha.
+            contribuicao_anterior = _contribuicao_no_resumo(veiculo) if veiculo.status == 'FINALIZADO' else None
             veiculo.placa = placa
             veiculo.origem = request.form.get('origem')
             veiculo.doca = doca
@@ -244,26 +1169,42 @@ def editar_veiculo(veiculo_id):
             veiculo.tipo_carga = carga_final 
             veiculo.rede_contencao = request.form.get('rede_contencao')
             veiculo.observacao = request.form.get('observacao')
+            if contribuicao_anterior and _contribuicao_no_resumo(veiculo) != contribuicao_anterior:
+                _atualizar_resumo(contribuicao_anterior, -1)
+                _atualizar_resumo(_contribuicao_no_resumo(veiculo), 1)
+            _indexar_busca([veiculo], 'ativo')
+            _registrar_alteracao(veiculo.id, 'alterado')
             log_action('EDITAR_VEICULO', f"Veículo placa '{placa}' foi editado.") 
             db.session.commit()
+            _veiculo_alterado(veiculo)
             flash(f'Veículo {placa} atualizado com sucesso!', 'success')
             return redirect(url_for('kanban.kanban'))
+        except IntegrityError as e:
+            db.session.rollback()
+            flash(_doca_tomada_no_commit(doca) if _conflito_de_doca(e) else f'Erro ao atualizar o veículo: {e}', 'error')
+            return render_template('editar_veiculo.html', veiculo=veiculo)
         except Exception as e:
             db.session.rollback()
             flash(f'Erro ao atualizar o veículo: {e}', 'error')
             return render_template('editar_veiculo.html', veiculo=veiculo)
+        finally:
+            if reserva is not None:
+                _liberar_doca(doca, reserva)
     return render_template('editar_veiculo.html', veiculo=veiculo)
 
  
- @kanban_bp.route('/excluir_veiculo/<int:veiculo_id>', methods=['POST'])
+@kanban_bp.route('/excluir_veiculo/<int:veiculo_id>', methods=['POST'])
 @login_required(roles=['ADMIN', 'T1', 'T2', 'T3'])
 def excluir_veiculo(veiculo_id):
     veiculo = Veiculo.query.get_or_404(veiculo_id)
     if veiculo.status == 'AGUARDANDO':
         try:
             db.session.delete(veiculo)
+            _desindexar_busca([veiculo_id], 'ativo')
+            _registrar_alteracao(veiculo_id, 'removido')
             log_action('EXCLUIR_VEICULO', f"Veículo placa '{veiculo.placa}' foi excluído.")
             db.session.commit()
+            _quadro_alterado('veiculo_removido', {'veiculo_id': veiculo_id})
             flash(f'Veículo de placa {veiculo.placa} excluído com sucesso.', 'success')
         except Exception as e:
             db.session.rollback()
@@ -274,7 +1215,7 @@ def excluir_veiculo(veiculo_id):
 
  
 
- @kanban_bp.route('/atualizar_status', methods=['POST'])
+@kanban_bp.route('/atualizar_status', methods=['POST'])
 @login_required(roles=['ADMIN', 'T1', 'T2', 'T3'])
 def atualizar_status():
     data = request.get_json()
@@ -284,12 +1225,41 @@ def atualizar_status():
 
     current_status = veiculo.status
     novo_status = data['novo_status'].replace('column-', '')
+    reservas = []
+    erro = _aplicar_transicao(veiculo, novo_status, datetime.now(), reservas)
+    if erro:
+        mensagem, codigo = erro
+        return jsonify({'success': False, 'message': mensagem}), codigo
+    
+    _registrar_alteracao(veiculo.id, 'alterado')
+    log_action('ATUALIZAR_STATUS', f"Status do veículo '{veiculo.placa}' alterado de '{current_status}' para '{novo_status}'.") 
 
-     if current_status == 'AGUARDANDO' and novo_status == 'EM_PROCESSO':
-        veiculo.hora_inicio = datetime.now()
+    try:
+        db.session.commit()
+        resposta = {'success': True, 'veiculo': _serializar_veiculo(veiculo)}
+        _quadro_alterado('veiculo', resposta)
+    except IntegrityError as e:
+        db.session.rollback()
+        if not _conflito_de_doca(e):
+            raise
+        return jsonify({'success': False, 'message': _doca_tomada_no_commit(reservas[0][0])}), 409
+    finally:
+        for doca, reserva in reservas:
+            _liberar_doca(doca, reserva)
+    return jsonify(resposta)
+
+
+def _aplicar_transicao(veiculo, novo_status, agora, reservas):
+    """
+    Aplica ao veículo a transição para `novo_status` no instante `agora`, com o resumo de descarga.
+    Devolve None ou (mensagem, código HTTP); a reserva da doca de um veículo reaberto vai para `reservas`.
+    """
+    current_status = veiculo.status
+    if current_status == 'AGUARDANDO' and novo_status == 'EM_PROCESSO':
+        veiculo.hora_inicio = agora
         veiculo.status = 'EM_PROCESSO'
     elif current_status == 'EM_PROCESSO' and novo_status == 'FINALIZADO':
-        veiculo.horario_atualizacao = datetime.now()
+        veiculo.horario_atualizacao = agora
         veiculo.status = 'FINALIZADO'
         veiculo.turno_finalizacao = get_shift_name_from_hour(veiculo.horario_atualizacao.hour)
         if veiculo.hora_inicio:
@@ -299,86 +1269,115 @@ def atualizar_status():
             minutes = int((total_seconds % 3600) // 60)
             if hours == 0 and minutes == 0 and total_seconds > 0: minutes = 1
             veiculo.tempo_descarga = f"{hours}h {minutes}m"
+            veiculo.tempo_descarga_segundos = int(total_seconds)
+        _atualizar_resumo(_contribuicao_no_resumo(veiculo), 1)
     elif current_status == 'FINALIZADO' and novo_status == 'EM_PROCESSO':
+        # De volta à doca, que pode ter sido ocupada por outro veículo depois da finalização.
+        doca = (veiculo.doca or '').strip()
+        if doca:
+            reserva, ocupante = _reservar_doca(doca, veiculo.id)
+            if reserva is None:
+                return _doca_ocupada(doca, ocupante), 409
+            reservas.append((doca, reserva))
+        _atualizar_resumo(_contribuicao_no_resumo(veiculo), -1)
         veiculo.status = 'EM_PROCESSO'
         veiculo.horario_atualizacao = None
         veiculo.tempo_descarga = None
+        veiculo.tempo_descarga_segundos = None
         veiculo.turno_finalizacao = None
     else:
-        return jsonify({'success': False, 'message': 'Transição de status inválida'}), 400
-    
-    log_action('ATUALIZAR_STATUS', f"Status do veículo '{veiculo.placa}' alterado de '{current_status}' para '{novo_status}'.") 
+        return 'Transição de status inválida', 400
+    return None
 
-    db.session.commit()
-    
-     finalization_class = 'status-ok'
-    if veiculo.status == 'FINALIZADO' and veiculo.tempo_descarga:
-        try:
-            horas_str = veiculo.tempo_descarga.split('h')[0].strip()
-            total_hours = float(horas_str)
-            if total_hours >= 4: finalization_class = 'status-atrasado'
-            elif total_hours >= 2: finalization_class = 'status-alerta'
-        except (ValueError, IndexError): pass
 
-     veiculo_data = {
-        'id': veiculo.id,
-        'placa': veiculo.placa,
-        'origem': veiculo.origem,
-        'id_viagem': veiculo.id_viagem,
-        'doca': veiculo.doca,
-        'turno': veiculo.turno,
-        'tipo_veiculo': veiculo.tipo_veiculo,
-        'tipo_carga': veiculo.tipo_carga,
-        'status': veiculo.status,
-        'hora_inicio': veiculo.hora_inicio.isoformat() if veiculo.hora_inicio else None,
-        'horario_atualizacao': veiculo.horario_atualizacao.isoformat() if veiculo.horario_atualizacao else None,
-        'turno_finalizacao': veiculo.turno_finalizacao,
-        'tempo_descarga': veiculo.tempo_descarga,
-        'finalization_status_class': finalization_class
-    }
+TRANSICOES_MAXIMAS_POR_LOTE = 200
+
+
+def _id_do_veiculo(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+@kanban_bp.route('/api/atualizar_status_em_lote', methods=['POST'])
+@login_required(roles=['ADMIN', 'T1', 'T2', 'T3'])
+def atualizar_status_em_lote():
+    """
+    Aplica uma onda de transições ({'alteracoes': [{'veiculo_id', 'novo_status'}, ...]}) numa única transação,
+    com o mesmo instante para todas. As que não se aplicam voltam em `erros`; as demais são gravadas.
+    """
+    alteracoes = (request.get_json(silent=True) or {}).get('alteracoes')
+    if not isinstance(alteracoes, list) or not alteracoes:
+        return jsonify({'success': False, 'message': 'Informe a lista de alterações.'}), 400
+    if len(alteracoes) > TRANSICOES_MAXIMAS_POR_LOTE:
+        return jsonify({'success': False, 'message': f'No máximo {TRANSICOES_MAXIMAS_POR_LOTE} alterações por lote.'}), 400
+
+    # Os ids chegam do JSON como o cliente os enviou ("2", 2, null, listas...): convertidos antes da busca.
+    alteracoes = [alteracao if isinstance(alteracao, dict) else {} for alteracao in alteracoes]
+    ids = [_id_do_veiculo(alteracao.get('veiculo_id')) for alteracao in alteracoes]
+    veiculos = {veiculo.id: veiculo for veiculo in Veiculo.query.filter(Veiculo.id.in_([id_ for id_ in ids if id_ is not None]))}
+    agora = datetime.now()
+    erros, alterados, descricoes, reservas, serializados = [], {}, [], [], []
+    try:
+        for alteracao, veiculo_id in zip(alteracoes, ids):
+            if veiculo_id is None:
+                erros.append({'veiculo_id': alteracao.get('veiculo_id'), 'message': 'ID de veículo inválido'})
+                continue
+            veiculo = veiculos.get(veiculo_id)
+            if veiculo is None:
+                erros.append({'veiculo_id': alteracao.get('veiculo_id'), 'message': 'Veículo não encontrado'})
+                continue
+            current_status = veiculo.status
+            novo_status = str(alteracao.get('novo_status') or '').replace('column-', '')
+            erro = _aplicar_transicao(veiculo, novo_status, agora, reservas)
+            if erro:
+                erros.append({'veiculo_id': veiculo.id, 'message': erro[0]})
+                continue
+            alterados[veiculo.id] = veiculo
+            descricoes.append(f"'{veiculo.placa}' de '{current_status}' para '{novo_status}'")
 
-    return jsonify({'success': True, 'veiculo': veiculo_data})
+        if alterados:
+            try:
+                for veiculo_id in alterados:
+                    _registrar_alteracao(veiculo_id, 'alterado')
+                log_action('ATUALIZAR_STATUS_EM_LOTE', f"Status de {len(descricoes)} veículo(s) alterado: {', '.join(descricoes)}.")
+                db.session.commit()
+                serializados = [_serializar_veiculo(veiculo) for veiculo in alterados.values()]
+                _quadro_alterado('veiculos', {'veiculos': serializados})
+            except IntegrityError as e:
+                db.session.rollback()
+                if not _conflito_de_doca(e):
+                    raise
+                with _trava_das_docas:
+                    _ocupacao_das_docas['docas'] = None
+                return jsonify({
+                    'success': False, 'erros': erros,
+                    'message': 'Uma das docas foi ocupada por outro veículo. Nenhuma alteração foi gravada; tente novamente.'
+                }), 409
+    finally:
+        for doca, reserva in reservas:
+            _liberar_doca(doca, reserva)
+    return jsonify({'success': not erros, 'veiculos': serializados, 'erros': erros})
 
 
  
- @kanban_bp.route('/arquivar_manualmente', methods=['POST'])
+@kanban_bp.route('/arquivar_manualmente', methods=['POST'])
 @login_required()
 def arquivar_manualmente():
-     turno_atual = get_shift_name_from_hour(datetime.now().hour)
-    
-     veiculos_finalizados = Veiculo.query.filter_by(status='FINALIZADO').all()
-    
-     veiculos_a_arquivar = [
-        v for v in veiculos_finalizados if v.turno_finalizacao != turno_atual
-    ]
-
-    if not veiculos_a_arquivar:
-        flash('Nenhum veículo de turnos anteriores para arquivar.', 'warning')
-        return redirect(url_for('kanban.kanban'))
-
     try:
-        for veiculo in veiculos_a_arquivar:
-            historico_entry = VeiculoHistorico(
-                placa=veiculo.placa, origem=veiculo.origem, turno=veiculo.turno, data=veiculo.data,
-                data_planejada=veiculo.data_planejada, data_checkin=veiculo.data_checkin,
-                hora_real_chegada=veiculo.hora_real_chegada, id_viagem=veiculo.id_viagem,
-                hora_inicio=veiculo.hora_inicio, volumetria_sistematica=veiculo.volumetria_sistematica,
-                tempo_descarga=veiculo.tempo_descarga, percent_ocupacao=veiculo.percent_ocupacao,
-                status_final='FINALIZADO', doca=veiculo.doca, tipo_carga=veiculo.tipo_carga,
-                tipo_veiculo=veiculo.tipo_veiculo, rede_contencao=veiculo.rede_contencao,
-                horario_atualizacao=veiculo.horario_atualizacao, turno_finalizacao=veiculo.turno_finalizacao,
-                observacao=veiculo.observacao, data_arquivamento=datetime.now()
-            )
-            db.session.add(historico_entry)
-            db.session.delete(veiculo)
-        
-        db.session.commit()
-        flash(f'{len(veiculos_a_arquivar)} veículo(s) de turnos anteriores foram arquivados.', 'success')
-    
+        ids_arquivados = arquivar_turnos_anteriores()
     except Exception as e:
         db.session.rollback()
         flash(f'Ocorreu um erro ao arquivar: {e}', 'error')
-    log_action('ARQUIVAR_VEICULOS', f"{len(veiculos_a_arquivar)} veículos foram arquivados manualmente.")
+        return redirect(url_for('kanban.kanban'))
+
+    if not ids_arquivados:
+        flash('Nenhum veículo de turnos anteriores para arquivar.', 'warning')
+        return redirect(url_for('kanban.kanban'))
+
+    flash(f'{len(ids_arquivados)} veículo(s) de turnos anteriores foram arquivados.', 'success')
+    log_action('ARQUIVAR_VEICULOS', f"{len(ids_arquivados)} veículos foram arquivados manualmente.")
     return redirect(url_for('kanban.kanban'))
 
  
@@ -386,9 +1385,9 @@ def arquivar_manualmente():
 @kanban_bp.route('/api/veiculo/<int:veiculo_id>')
 @login_required()
 def get_veiculo_details(veiculo_id):
-     veiculo = Veiculo.query.get_or_404(veiculo_id)
+    veiculo = Veiculo.query.get_or_404(veiculo_id)
     
-     details = {
+    details = {
         'placa': veiculo.placa,
         'origem': veiculo.origem,
         'turno': veiculo.turno,
@@ -409,14 +1408,29 @@ def get_veiculo_details(veiculo_id):
         'tempo_descarga': veiculo.tempo_descarga
     }
     
-     return jsonify(details)
+    return jsonify(details)
 
  
- @kanban_bp.route('/api/dock_status')
+@kanban_bp.route('/api/dock_status')
 @login_required()
 def api_dock_status():
-    lista_docas = list(range(1, 31)) + list(range(61, 91))
-    dock_data = {str(i): {'status': 'LIVRE', 'placa': None, 'timing_status': None, 'hora_inicio': None, 'veiculo_id': None} for i in lista_docas}
+    return _responder_snapshot(_snapshot('dock_status', _montar_status_das_docas))
+
+
+@kanban_bp.route('/api/docas/sugestao')
+@login_required()
+def api_sugestao_de_doca():
+    """
+    Sugere ao formulário de cadastro a doca livre mais próxima de ?perto= (ou a menor livre).
+    """
+    perto = request.args.get('perto', type=int)
+    doca = _doca_livre_mais_proxima(perto)
+    return jsonify({'doca': str(doca) if doca is not None else None})
+
+
+def _montar_status_das_docas(agora):
+    dock_data = {str(i): {'status': 'LIVRE', 'placa': None, 'timing_status': None, 'hora_inicio': None, 'veiculo_id': None} for i in DOCAS}
+    proxima_mudanca = None
     
     veiculos_em_docas = Veiculo.query.filter(Veiculo.doca.isnot(None), Veiculo.status.in_(['AGUARDANDO', 'EM_PROCESSO'])).all()
     
@@ -427,20 +1441,25 @@ def api_dock_status():
             timing_status = None
             hora_inicio_iso = None 
             
-              if veiculo.status == 'EM_PROCESSO' and veiculo.hora_inicio:
+            if veiculo.status == 'EM_PROCESSO' and veiculo.hora_inicio:
                 try:
-                    duration = datetime.now() - veiculo.hora_inicio
+                    duration = agora - veiculo.hora_inicio
                     hora_inicio_iso = veiculo.hora_inicio.isoformat()
-                    if duration.total_seconds() > 14400: # 4 horas
+                    if duration.total_seconds() > HORAS_ATRASO * 3600: # 4 horas
                         timing_status = 'LATE' 
-                    elif duration.total_seconds() > 7200: # 2 horas
+                    elif duration.total_seconds() > HORAS_ALERTA * 3600: # 2 horas
                         timing_status = 'WARNING'
                     else:
                         timing_status = 'ON_TIME'
+                    # A resposta muda sozinha quando a doca passa para a próxima faixa de tempo.
+                    for horas in (HORAS_ALERTA, HORAS_ATRASO):
+                        virada = veiculo.hora_inicio + timedelta(hours=horas)
+                        if virada >= agora and (proxima_mudanca is None or virada < proxima_mudanca):
+                            proxima_mudanca = virada
                 except TypeError:
                     timing_status = None
             
-             elif veiculo.status == 'AGUARDANDO' and veiculo.data:
+            elif veiculo.status == 'AGUARDANDO' and veiculo.data:
                 hora_inicio_iso = veiculo.data.isoformat()
  
             dock_data[cleaned_dock_str] = {
@@ -451,142 +1470,302 @@ def api_dock_status():
                 'veiculo_id': veiculo.id 
             }
     
-    return jsonify(dock_data)
+    return dock_data, proxima_mudanca + timedelta(seconds=1) if proxima_mudanca else None
 
  
 
 @kanban_bp.route('/api/status_counts')
 @login_required()
 def get_status_counts():
-    now = datetime.now()
-    current_shift_name = get_shift_name_from_hour(now.hour) # Pega o turno baseado na hora atual
-    
-    start_shift, end_shift = get_shift_boundaries(now, current_shift_name) 
+    return _responder_snapshot(_snapshot('status_counts', _montar_contagem_de_status))
 
-     print(f"\n--- API STATUS COUNTS DEBUG ---")
-    print(f"Hora Atual da Requisição: {now}")
-    print(f"Turno Atual Detectado: {current_shift_name}")
-    print(f"Limites do Turno: {start_shift} (Início) a {end_shift} (Fim)")
-    
-     finished_in_current_table = Veiculo.query.filter(
-        Veiculo.status == 'FINALIZADO',
-        Veiculo.horario_atualizacao >= start_shift,
-        Veiculo.horario_atualizacao < end_shift
-    ).count()
-
-     finished_in_history_table = 0
-    if start_shift and end_shift: # Garante que os limites são válidos antes de consultar o histórico
-        finished_in_history_table = VeiculoHistorico.query.filter(
-            VeiculoHistorico.horario_atualizacao >= start_shift,
-            VeiculoHistorico.horario_atualizacao < end_shift
-        ).count()
-    
-     finished_in_shift_count = Veiculo.query.filter_by(status='FINALIZADO').count()
 
-    waiting_vehicles_count = Veiculo.query.filter_by(status='AGUARDANDO').count()
-    in_process_vehicles_count = Veiculo.query.filter_by(status='EM_PROCESSO').count()
-    
-    print(f"Contagens atualizadas -> Finalizados: {finished_in_shift_count}, Aguardando: {waiting_vehicles_count}, Em Processo: {in_process_vehicles_count}")
+def _montar_contagem_de_status(agora):
+    current_shift_name = get_shift_name_from_hour(agora.hour) # Pega o turno baseado na hora atual
+    _, end_shift = get_shift_boundaries(agora, current_shift_name)
+    kanban_counts, _ = _contadores_do_quadro(agora)
 
-    return jsonify({
+    return {
         'shift_name': current_shift_name,
-        'finished_count': finished_in_shift_count,
-        'waiting_count': waiting_vehicles_count,
-        'in_process_count': in_process_vehicles_count
+        'finished_count': kanban_counts['finalizado'],
+        'waiting_count': kanban_counts['aguardando'],
+        'in_process_count': kanban_counts['em_processo']
+    }, end_shift
+
+
+@kanban_bp.route('/api/board')
+@login_required()
+def api_board():
+    """
+    Sincronização incremental: com ?since=<versão>, só os veículos criados ou alterados e os ids removidos
+    ou arquivados depois dela, mais os contadores. Sem `since`, ou se o diário já não cobre a versão
+    pedida, devolve o quadro completo ('completo': true).
+    """
+    desde = request.args.get('since', type=int)
+    versao, mais_antiga = db.session.query(func.max(AlteracaoQuadro.id), func.min(AlteracaoQuadro.id)).one()
+    versao = versao or 0
+    completo = desde is None or desde > versao or (mais_antiga is not None and desde < mais_antiga - 1)
+
+    removidos, arquivados = [], []
+    if completo:
+        veiculos = Veiculo.query.order_by(*ORDEM_DO_QUADRO).all()
+    else:
+        # Em ordem de versão: vale a última alteração de cada veículo.
+        ultima_alteracao = dict(
+            db.session.query(AlteracaoQuadro.veiculo_id, AlteracaoQuadro.tipo)
+            .filter(AlteracaoQuadro.id > desde, AlteracaoQuadro.id <= versao)
+            .order_by(AlteracaoQuadro.id)
+        )
+        alterados = [veiculo_id for veiculo_id, tipo in ultima_alteracao.items() if tipo == 'alterado']
+        removidos = [veiculo_id for veiculo_id, tipo in ultima_alteracao.items() if tipo == 'removido']
+        arquivados = [veiculo_id for veiculo_id, tipo in ultima_alteracao.items() if tipo == 'arquivado']
+        veiculos = Veiculo.query.filter(Veiculo.id.in_(alterados)).order_by(*ORDEM_DO_QUADRO).all() if alterados else []
+
+    kanban_counts, processo_contadores = _contadores_do_quadro(datetime.now())
+    return jsonify({
+        'versao': versao,
+        'completo': completo,
+        'veiculos': [_serializar_veiculo(veiculo) for veiculo in veiculos],
+        'removidos': removidos,
+        'arquivados': arquivados,
+        'kanban_counts': kanban_counts,
+        'processo_contadores': processo_contadores
     })
 
+
+@kanban_bp.route('/api/analytics/descarga')
+@login_required()
+def api_analytics_descarga():
+    """
+    Quantidade, tempo médio e p90 de descarga e ocupação média por doca, origem, tipo de veículo ou turno
+    (?agrupar=), entre os dias ?de= e ?ate= (AAAA-MM-DD; padrão: últimos 7 dias), lidos só dos resumos por turno.
+    """
+    agrupar = request.args.get('agrupar', 'doca')
+    if agrupar not in AGRUPAMENTOS_DO_RESUMO:
+        return jsonify({'success': False, 'message': f"Agrupamento inválido. Use: {', '.join(AGRUPAMENTOS_DO_RESUMO)}."}), 400
+    try:
+        ate = date.fromisoformat(request.args['ate']) if request.args.get('ate') else datetime.now().date()
+        de = date.fromisoformat(request.args['de']) if request.args.get('de') else ate - timedelta(days=DIAS_PADRAO_DA_ANALISE - 1)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Datas devem estar no formato AAAA-MM-DD.'}), 400
+
+    grupos, grupo_do_resumo = {}, {}
+    no_periodo = ResumoTurnoDescarga.dia_turno.between(de, ate)
+    for resumo in ResumoTurnoDescarga.query.filter(no_periodo):
+        grupo = grupos.setdefault(getattr(resumo, agrupar), {
+            'quantidade': 0, 'quantidade_com_tempo': 0, 'soma_segundos': 0, 'soma_ocupacao': 0, 'histograma': {}
+        })
+        grupo_do_resumo[resumo.id] = grupo
+        grupo['quantidade'] += resumo.quantidade
+        grupo['quantidade_com_tempo'] += resumo.quantidade_com_tempo
+        grupo['soma_segundos'] += resumo.soma_segundos_descarga
+        grupo['soma_ocupacao'] += resumo.soma_percent_ocupacao
+    faixas = db.session.query(FaixaResumoDescarga.resumo_id, FaixaResumoDescarga.faixa, FaixaResumoDescarga.quantidade).join(
+        ResumoTurnoDescarga, ResumoTurnoDescarga.id == FaixaResumoDescarga.resumo_id
+    ).filter(no_periodo, FaixaResumoDescarga.quantidade > 0)
+    for resumo_id, faixa, quantidade in faixas:
+        histograma = grupo_do_resumo[resumo_id]['histograma']
+        histograma[faixa] = histograma.get(faixa, 0) + quantidade
+
+    resultado = []
+    for chave in sorted(grupos):
+        grupo = grupos[chave]
+        if not grupo['quantidade']:
+            continue
+        resultado.append({
+            agrupar: chave,
+            'quantidade': grupo['quantidade'],
+            'media_segundos_descarga': round(grupo['soma_segundos'] / grupo['quantidade_com_tempo']) if grupo['quantidade_com_tempo'] else None,
+            'p90_segundos_descarga': _percentil_do_histograma(grupo['histograma'], 0.9),
+            'ocupacao_media': round(grupo['soma_ocupacao'] / grupo['quantidade'], 1)
+        })
+    return jsonify({'de': de.isoformat(), 'ate': ate.isoformat(), 'agrupar': agrupar, 'grupos': resultado})
+
+
+@kanban_bp.route('/api/eventos')
+@login_required()
+def api_eventos():
+    """
+    Canal de Server-Sent Events com as alterações do quadro (eventos 'veiculo', 'veiculo_removido',
+    'veiculos_arquivados' e 'recarregar'), lidas do diário compartilhado entre os processos.
+    Cada conexão aberta fica presa a uma thread até ser encerrada (no máximo SEGUNDOS_POR_CONEXAO): o
+    servidor precisa de workers assíncronos (gunicorn com gevent ou eventlet), em que uma tela ociosa é só
+    uma greenlet parada, sem consultas ao banco. Com workers síncronos, cada tela aberta ocupa um worker.
+    """
+    _iniciar_leitor_do_diario()
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        ultimo_id = int(ultimo_id) if ultimo_id else None
+    except ValueError:
+        ultimo_id = -1
+    resposta = current_app.response_class(_eventos_a_partir_de(ultimo_id), mimetype='text/event-stream')
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.headers['X-Accel-Buffering'] = 'no'
+    return resposta
+
  
 
- @kanban_bp.route('/set-theme/<theme>')
+@kanban_bp.route('/set-theme/<theme>')
 def set_theme(theme):
     session['theme'] = theme
     return jsonify(success=True)
 
-@kanban_bp.route('/vehicles')
-@login_required(roles=['ADMIN', 'T1', 'T2', 'T3', 'AUDITOR'])
-def list_vehicles():
+# --- LISTAGEM DE VEÍCULOS (ATIVOS + HISTÓRICO) ---
+VEICULOS_POR_PAGINA = 200
+LINHAS_POR_BLOCO_CSV = 1000
+COLUNAS_DA_LISTAGEM = [
+    'id', 'placa', 'motorista', 'origem', 'turno', 'data', 'data_planejada', 'data_checkin', 'hora_real_chegada',
+    'id_viagem', 'tipo_veiculo', 'tipo_carga', 'volumetria_sistematica', 'percent_ocupacao', 'rede_contencao',
+    'doca', 'hora_inicio', 'horario_atualizacao', 'turno_finalizacao', 'tempo_descarga', 'tempo_descarga_segundos', 'observacao'
+]
+
+
+def _ler_filtros_de_veiculos():
     """
-    Lista todos os veículos ativos e históricos com filtros.
-    Agora, o filtro de data padrão é o turno atual.
+    Lê os filtros de /vehicles da query string. Sem datas, o período padrão é o turno atual.
     """
-     data_inicio_str = request.args.get('data_inicio')
+    filtros = {
+        'data_inicio': None,
+        'data_fim': None,
+        'placa': request.args.get('placa'),
+        'status': request.args.get('status'),
+        'motorista': request.args.get('motorista'),
+        'tipo_veiculo': request.args.get('tipo_veiculo'),
+        'turno': request.args.get('turno'),
+        'default_data_inicio': '',
+        'default_data_fim': '',
+    }
+    data_inicio_str = request.args.get('data_inicio')
     data_fim_str = request.args.get('data_fim')
-    placa_filtro = request.args.get('placa')
-    status_filtro = request.args.get('status')
-    motorista_filtro = request.args.get('motorista')
-    tipo_veiculo_filtro = request.args.get('tipo_veiculo')
-    turno_filtro = request.args.get('turno') 
-
-     default_data_inicio_str = ''
-    default_data_fim_str = ''
     if not data_inicio_str and not data_fim_str:
         now = datetime.now()
         current_shift_name = get_shift_name_from_hour(now.hour)
         start_shift, end_shift = get_shift_boundaries(now, current_shift_name)
-        default_data_inicio_str = start_shift.strftime('%d/%m/%Y %H:%M:%S') if start_shift else ''
-        default_data_fim_str = end_shift.strftime('%d/%m/%Y %H:%M:%S') if end_shift else ''
-        
-         data_inicio_str = default_data_inicio_str
-        data_fim_str = default_data_fim_str
+        filtros['default_data_inicio'] = start_shift.strftime('%d/%m/%Y %H:%M:%S') if start_shift else ''
+        filtros['default_data_fim'] = end_shift.strftime('%d/%m/%Y %H:%M:%S') if end_shift else ''
+        data_inicio_str = filtros['default_data_inicio']
+        data_fim_str = filtros['default_data_fim']
 
-    data_inicio = None
     if data_inicio_str:
         try:
-            data_inicio = datetime.strptime(data_inicio_str, '%d/%m/%Y %H:%M:%S')
+            filtros['data_inicio'] = datetime.strptime(data_inicio_str, '%d/%m/%Y %H:%M:%S')
         except ValueError:
             flash("Formato de data de início inválido. Ignorando filtro.", "warning")
-            data_inicio = None #
-
-    data_fim = None
     if data_fim_str:
         try:
-            data_fim = datetime.strptime(data_fim_str, '%d/%m/%Y %H:%M:%S')
+            filtros['data_fim'] = datetime.strptime(data_fim_str, '%d/%m/%Y %H:%M:%S')
         except ValueError:
             flash("Formato de data final inválido. Ignorando filtro.", "warning")
-            data_fim = None # Resetar para não usar data inválida
-
-
-     query_ativos = Veiculo.query
-    query_historico = VeiculoHistorico.query
-
-     if data_inicio:
-        query_ativos = query_ativos.filter(Veiculo.data >= data_inicio)
-        query_historico = query_historico.filter(VeiculoHistorico.data >= data_inicio)
-    if data_fim:
-        query_ativos = query_ativos.filter(Veiculo.data <= data_fim)
-        query_historico = query_historico.filter(VeiculoHistorico.data <= data_fim)
-
-     if placa_filtro:
-        query_ativos = query_ativos.filter(Veiculo.placa.ilike(f'%{placa_filtro}%'))
-        query_historico = query_historico.filter(VeiculoHistorico.placa.ilike(f'%{placa_filtro}%'))
-    if status_filtro and status_filtro != 'todos':
-        query_ativos = query_ativos.filter(Veiculo.status == status_filtro)
-        query_historico = query_historico.filter(VeiculoHistorico.status_final == status_filtro)
-    if motorista_filtro:
-        query_ativos = query_ativos.filter(Veiculo.motorista.ilike(f'%{motorista_filtro}%'))
-        query_historico = query_historico.filter(VeiculoHistorico.motorista.ilike(f'%{motorista_filtro}%'))
-    if tipo_veiculo_filtro and tipo_veiculo_filtro != 'todos':
-        query_ativos = query_ativos.filter(Veiculo.tipo_veiculo == tipo_veiculo_filtro)
-        query_historico = query_historico.filter(VeiculoHistorico.tipo_veiculo == tipo_veiculo_filtro)
-    
-     if turno_filtro and turno_filtro != 'todos':
-        query_ativos = query_ativos.filter(Veiculo.turno == turno_filtro)
-        query_historico = query_historico.filter(VeiculoHistorico.turno == turno_filtro)
+    return filtros
+
+
+def _condicoes_da_listagem(modelo, coluna_status, filtros):
+    condicoes = []
+    if filtros['data_inicio']:
+        condicoes.append(modelo.data >= filtros['data_inicio'])
+    if filtros['data_fim']:
+        condicoes.append(modelo.data <= filtros['data_fim'])
+    if filtros['placa']:
+        condicoes.append(_condicao_de_busca(modelo, 'placa', filtros['placa']))
+    if filtros['status'] and filtros['status'] != 'todos':
+        condicoes.append(coluna_status == filtros['status'])
+    if filtros['motorista']:
+        condicoes.append(_condicao_de_busca(modelo, 'motorista', filtros['motorista']))
+    if filtros['tipo_veiculo'] and filtros['tipo_veiculo'] != 'todos':
+        condicoes.append(modelo.tipo_veiculo == filtros['tipo_veiculo'])
+    if filtros['turno'] and filtros['turno'] != 'todos':
+        condicoes.append(modelo.turno == filtros['turno'])
+    return condicoes
+
+
+def _listagem_de_veiculos(filtros):
+    """
+    Ativos e histórico num único UNION ALL feito pelo banco. As linhas têm os mesmos nomes e tipos de atributo
+    dos modelos (`status` nos ativos, `status_final` e `data_arquivamento` no histórico) e a coluna `fonte`.
+    """
+    # Os NULLs de preenchimento levam o tipo da coluna real: o UNION tira os tipos do primeiro SELECT e, com
+    # um NULL sem tipo, data_arquivamento voltaria como texto no SQLite.
+    ativos = select(
+        *[getattr(Veiculo, coluna).label(coluna) for coluna in COLUNAS_DA_LISTAGEM],
+        Veiculo.status.label('status'),
+        type_coerce(null(), VeiculoHistorico.status_final.type).label('status_final'),
+        type_coerce(null(), VeiculoHistorico.data_arquivamento.type).label('data_arquivamento'),
+        literal('ativo').label('fonte')
+    ).where(*_condicoes_da_listagem(Veiculo, Veiculo.status, filtros))
+    historico = select(
+        *[getattr(VeiculoHistorico, coluna).label(coluna) for coluna in COLUNAS_DA_LISTAGEM],
+        type_coerce(null(), Veiculo.status.type).label('status'), VeiculoHistorico.status_final.label('status_final'),
+        VeiculoHistorico.data_arquivamento.label('data_arquivamento'), literal('historico').label('fonte')
+    ).where(*_condicoes_da_listagem(VeiculoHistorico, VeiculoHistorico.status_final, filtros))
+    listagem = union_all(ativos, historico).subquery('listagem')
+    return listagem, select(listagem).order_by(listagem.c.data.desc(), listagem.c.fonte.desc(), listagem.c.id.desc())
 
 
-    veiculos = query_ativos.order_by(Veiculo.data.desc()).all()
-    historico = query_historico.order_by(VeiculoHistorico.data.desc()).all()
+def _cursor_da_linha(linha):
+    return f"{linha.data.isoformat()}|{linha.fonte}|{linha.id}"
 
-     todos_veiculos = sorted(veiculos + historico, key=lambda x: x.data, reverse=True)
 
-     return render_template(
+def _ler_cursor(texto):
+    try:
+        data, fonte, veiculo_id = texto.split('|')
+        return datetime.fromisoformat(data), fonte, int(veiculo_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+@kanban_bp.route('/vehicles')
+@login_required(roles=['ADMIN', 'T1', 'T2', 'T3', 'AUDITOR'])
+def list_vehicles():
+    """
+    Lista os veículos ativos e históricos com filtros, do mais novo para o mais antigo, uma página por vez.
+    O filtro de data padrão é o turno atual; ?apos=<cursor> continua a partir da última linha da página anterior.
+    """
+    filtros = _ler_filtros_de_veiculos()
+    listagem, consulta = _listagem_de_veiculos(filtros)
+
+    cursor = _ler_cursor(request.args.get('apos'))
+    if cursor:
+        consulta = consulta.where(tuple_(listagem.c.data, listagem.c.fonte, listagem.c.id) < tuple_(*cursor))
+    linhas = db.session.execute(consulta.limit(VEICULOS_POR_PAGINA + 1)).all()
+    todos_veiculos = linhas[:VEICULOS_POR_PAGINA]
+    proxima_pagina = _cursor_da_linha(todos_veiculos[-1]) if len(linhas) > VEICULOS_POR_PAGINA else None
+
+    return render_template(
         'list_vehicles.html', 
         veiculos=todos_veiculos,
-        placa_filtro=placa_filtro,
-        status_filtro=status_filtro,
-        motorista_filtro=motorista_filtro,
-        tipo_veiculo_filtro=tipo_veiculo_filtro,
-        turno_filtro=turno_filtro, # Passa o filtro de turno para o template
-        default_data_inicio=default_data_inicio_str, # Passa as datas padrão
-        default_data_fim=default_data_fim_str,       # Passa as datas padrão
-     )
+        proxima_pagina=proxima_pagina,
+        placa_filtro=filtros['placa'],
+        status_filtro=filtros['status'],
+        motorista_filtro=filtros['motorista'],
+        tipo_veiculo_filtro=filtros['tipo_veiculo'],
+        turno_filtro=filtros['turno'], # Passa o filtro de turno para o template
+        default_data_inicio=filtros['default_data_inicio'], # Passa as datas padrão
+        default_data_fim=filtros['default_data_fim'],       # Passa as datas padrão
+    )
+
+
+@kanban_bp.route('/vehicles/export.csv')
+@login_required(roles=['ADMIN', 'T1', 'T2', 'T3', 'AUDITOR'])
+def export_vehicles():
+    """
+    Exporta em CSV o mesmo resultado filtrado de /vehicles, sem paginação, lendo e enviando em blocos.
+    """
+    filtros = _ler_filtros_de_veiculos()
+    _, consulta = _listagem_de_veiculos(filtros)
+    cabecalho = COLUNAS_DA_LISTAGEM + ['status', 'status_final', 'data_arquivamento', 'fonte']
+
+    def gerar_csv():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        escritor.writerow(cabecalho)
+        resultado = db.session.execute(consulta.execution_options(yield_per=LINHAS_POR_BLOCO_CSV))
+        for bloco in resultado.partitions():
+            escritor.writerows(bloco)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    resposta = current_app.response_class(stream_with_context(gerar_csv()), mimetype='text/csv')
+    resposta.headers['Content-Disposition'] = f"attachment; filename=veiculos_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
+    return resposta